@@ -1,14 +1,32 @@
 #!/usr/bin/python3
+import asyncio
 import logging
 import os
+import signal
 import time
+from typing import Optional
 
-from pydantic import BaseModel
+from telegram import Update
 from telegram.ext import Application, CallbackQueryHandler, CommandHandler, MessageHandler, filters
 
 from config import settings
-from handlers import button, handle_datepicker_input, help_command, start, stop
-from scheduler import pop_job  # фон как JobQueue-джоба
+import db
+import metrics
+from handlers import (
+    button,
+    calendar_sweeper,
+    handle_datepicker_input,
+    help_command,
+    profile_command,
+    start,
+    stop,
+    user_states,
+)
+from jobstore import job_store
+from processor import PerUserUpdateProcessor
+from profiling import profiler
+from scheduler import reminder_queue  # будит pop_job через JobQueue точно к сроку
+from sendqueue import send_queue
 
 # ЧАСОВОЙ ПОЯС: под вашу локацию (Германия)
 os.environ["TZ"] = "Europe/Moscow"
@@ -21,32 +39,178 @@ logger = logging.getLogger(__name__)
 
 TOKEN = settings.TOKEN
 
+# Замер отставания event loop и сервер метрик при long polling
+_loop_lag_task: Optional[asyncio.Task] = None
+# Проверка Mongo и отложенный до её готовности старт расписания/состояний
+_mongo_task: Optional[asyncio.Task] = None
+_storage_task: Optional[asyncio.Task] = None
+_metrics_server = None
+_metrics_task: Optional[asyncio.Task] = None
+# Пауза между попытками запуска хранилища: 1 с, 2 с, 4 с, ... не больше минуты
+STORAGE_RETRY_MIN_SECONDS = 1.0
+STORAGE_RETRY_MAX_SECONDS = 60.0
+
+
+async def _persist_states(context) -> None:
+    """Сохраняем изменённые состояния пользователей и отчитываемся о размере хранилища."""
+    await user_states.persist()
+    logger.debug("user_states: %d пользователей, ~%d байт", len(user_states), user_states.memory_bytes())
+
 
-class HealthCheck(BaseModel):
-    status: str = "OK"
+async def _start_storage(app: Application) -> None:
+    """Дожидаемся Mongo и поднимаем всё, что читает из неё при старте.
+
+    При ошибке повторяем с экспоненциальной паузой: без этого расписание и
+    сохранение состояний не запустились бы до рестарта процесса.
+    """
+    delay = STORAGE_RETRY_MIN_SECONDS
+    while True:
+        await db.mongo.wait_ready()
+        try:
+            # Старые записи хранят только строку date — дозаполняем due_at до первого тика
+            await db.migrate_legacy_dates()
+            await reminder_queue.start(app)
+            logger.info("Reminder queue started: %d upcoming reminders", len(reminder_queue))
+            await user_states.restore()
+            # Календари, открытые до рестарта, снова истекают по своим срокам
+            await calendar_sweeper.restore(app.job_queue)
+            break
+        except Exception:  # pragma: no cover - logging only
+            # У TimeoutError пустое сообщение — пишем трейсбек целиком
+            logger.exception("Ошибка запуска хранилища, повтор через %.0f с", delay)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, STORAGE_RETRY_MAX_SECONDS)
+    app.job_queue.run_repeating(
+        _persist_states, interval=settings.STATE_PERSIST_SECONDS, name="persist_states"
+    )
 
 
 async def _post_init(app: Application) -> None:
-    """Регистрируем фоновую задачу через JobQueue в том же event loop, что и бот."""
-    app.job_queue.run_repeating(pop_job, interval=10, first=5)  # окно 10s, старт через 5s
-    logger.info("JobQueue pop_job scheduled: first=5s, interval=10s")
+    """Регистрируем фоновые задачи в том же event loop, что и бот.
+
+    Mongo не ждём: бот начинает принимать обновления сразу, а расписание и
+    состояния загружаются, как только Mongo ответит (см. /ready).
+    """
+    global _loop_lag_task, _metrics_task, _mongo_task, _storage_task
+    if settings.SCHEDULER_SWEEP_SECONDS > 0 and not settings.WEBHOOK_MODE:
+        # Подбор чужих напоминаний нужен только нескольким репликам, а они работают лишь с вебхуком
+        logger.warning(
+            "SCHEDULER_SWEEP_SECONDS задан при long polling: несколько реплик с polling "
+            "получают 409 Conflict от getUpdates и не делят состояние пользователей — "
+            "для replicas > 1 нужен WEBHOOK_MODE с привязкой пользователя к реплике"
+        )
+    _mongo_task = asyncio.create_task(db.mongo.watch(settings.MONGO_PING_SECONDS))
+    _storage_task = asyncio.create_task(_start_storage(app))
+    _loop_lag_task = asyncio.create_task(metrics.watch_loop_lag())
+    if hasattr(signal, "SIGUSR2"):
+        # kill -USR2 <pid> включает/выключает профилирование без рестарта
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR2, profiler.toggle)
+    if settings.PROFILING_ENABLED:
+        profiler.enable()
+    if settings.METRICS_ENABLED and not settings.WEBHOOK_MODE:
+        _metrics_task = asyncio.create_task(_serve_metrics(app))
+
+
+async def _serve_metrics(app: Application) -> None:
+    """При long polling /metrics, /health и /ready отдаёт отдельный uvicorn в том же event loop.
+
+    fastapi и uvicorn импортируются уже в фоне, пока идёт первый запрос к Bot API,
+    а не до начала polling.
+    """
+    global _metrics_server
+    from web import create_server, create_web_app
+
+    _metrics_server = create_server(create_web_app(app, webhook=False), embedded=True)
+    try:
+        await _metrics_server.serve()
+    except SystemExit:
+        # uvicorn завершает процесс, если порт занят; без /metrics бот продолжает работать
+        logger.error(
+            "Сервер метрик не запущен: порт %s:%s недоступен, polling продолжается",
+            settings.LISTEN_HOST, settings.PORT,
+        )
+        _metrics_server = None
+
+
+async def _post_shutdown(app: Application) -> None:
+    """Дописываем буфер и дожидаемся незавершённых запросов к Mongo при остановке."""
+    for task in (_storage_task, _mongo_task):
+        if task is not None:
+            task.cancel()
+    if db.mongo.ready:
+        await user_states.persist()
+    await db.write_buffer.flush()
+    await job_store.flush()
+    db.shutdown()
+    profiler.disable()
+    if _loop_lag_task is not None:
+        _loop_lag_task.cancel()
+    if _metrics_server is not None:
+        _metrics_server.should_exit = True
+        await _metrics_task
+    elif _metrics_task is not None:
+        _metrics_task.cancel()
 
 
 def build_app() -> Application:
     tg_app = (
         Application.builder()
         .token(TOKEN)
+        .base_url(settings.BOT_API_URL)
+        # Разные пользователи обрабатываются параллельно, обновления одного — строго по очереди
+        .concurrent_updates(
+            PerUserUpdateProcessor(settings.MAX_CONCURRENT_UPDATES, settings.MAX_PENDING_UPDATES)
+        )
+        # Задержки и ошибки каждого метода Bot API попадают в метрики
+        .request(metrics.InstrumentedRequest(connection_pool_size=256))
         .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
         .build()
     )
+    metrics.user_states_size.set_function(lambda: len(user_states))
+    metrics.user_states_bytes.set_function(user_states.memory_bytes)
+    metrics.send_queue_depth.set_function(lambda: send_queue.depth)
+    metrics.update_queue_max.set_function(lambda: tg_app.update_processor.max_queue_length)
     tg_app.add_handler(CommandHandler("start", start))
     tg_app.add_handler(CommandHandler("stop", stop))
     tg_app.add_handler(CallbackQueryHandler(button))
     tg_app.add_handler(CommandHandler("help", help_command))
+    tg_app.add_handler(CommandHandler("profile", profile_command))
     tg_app.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, handle_datepicker_input))
+    # При включённом профилировании каждый обработчик пишет span со своим временем
+    for group in tg_app.handlers.values():
+        for handler in group:
+            handler.callback = profiler.traced(handler.callback)
     return tg_app
 
 
+async def run_webhook(tg_app: Application) -> None:
+    """Принимаем обновления вебхуком через ASGI-сервер за nginx вместо long polling."""
+    if not settings.WEBHOOK_SECRET:
+        # Без секрета публичный /telegram принимал бы поддельные обновления от кого угодно
+        raise SystemExit("WEBHOOK_MODE=true требует WEBHOOK_SECRET")
+    from web import create_server, create_web_app
+
+    server = create_server(create_web_app(tg_app))
+    async with tg_app:
+        await tg_app.bot.set_webhook(
+            url=settings.MYHOSTNAME.rstrip("/") + settings.WEBHOOK_PATH,
+            secret_token=settings.WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await tg_app.start()
+        # post_init/post_shutdown вызывает только run_polling/run_webhook — здесь сами
+        await _post_init(tg_app)
+        try:
+            await server.serve()
+        finally:
+            await tg_app.stop()
+            await _post_shutdown(tg_app)
+
+
 if __name__ == "__main__":
     app = build_app()
-    app.run_polling()
+    if settings.WEBHOOK_MODE:
+        asyncio.run(run_webhook(app))
+    else:
+        app.run_polling()
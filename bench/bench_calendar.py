@@ -0,0 +1,63 @@
+"""Micro-benchmark of the calendar keyboard builder.
+
+Replays a user paging through the calendar (minutes, hours, days, months)
+and compares the uncached builder with the memoized ``create_calendar``.
+
+    python bench/bench_calendar.py [clicks]
+"""
+
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import dateutil.relativedelta  # noqa: E402
+
+import telegramcalendar  # noqa: E402
+
+STEPS = [
+    dateutil.relativedelta.relativedelta(minutes=1),
+    dateutil.relativedelta.relativedelta(minutes=-1),
+    dateutil.relativedelta.relativedelta(hours=1),
+    dateutil.relativedelta.relativedelta(days=1),
+    dateutil.relativedelta.relativedelta(months=1),
+    dateutil.relativedelta.relativedelta(months=-1),
+]
+
+
+def clicks(count):
+    cur = datetime.datetime(2024, 1, 15, 12, 0)
+    for i in range(count):
+        cur += STEPS[i % len(STEPS)]
+        yield cur
+
+
+def run(build, dates):
+    started = time.perf_counter()
+    for cur in dates:
+        build(cur)
+    return time.perf_counter() - started
+
+
+def uncached(cur):
+    telegramcalendar._grid_rows.cache_clear()
+    return telegramcalendar._build_calendar.__wrapped__(cur.year, cur.month, cur.day, cur.hour, cur.minute)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    dates = list(clicks(count))
+    cold = run(uncached, dates)
+    telegramcalendar._build_calendar.cache_clear()
+    telegramcalendar._grid_rows.cache_clear()
+    warm = run(telegramcalendar.create_calendar, dates)
+    for name, elapsed in (("без кэша", cold), ("с кэшем", warm)):
+        print(f"{name:>10}: {elapsed / count * 1e6:8.1f} мкс/клавиатура")
+    print(f"   ускорение: x{cold / warm:.1f}")
+    print(f"   {telegramcalendar._build_calendar.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
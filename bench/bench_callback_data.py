@@ -0,0 +1,68 @@
+"""Micro-benchmark of the calendar callback_data codec.
+
+Compares the compact ``C1`` format with the legacy ``CALENDAR;...`` strings:
+encode/decode time per button (``decode`` hits the parse cache, ``cold``
+bypasses it) and the JSON size of a whole calendar markup.
+
+    python bench/bench_callback_data.py [iterations]
+"""
+
+import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import messages  # noqa: E402
+import telegramcalendar  # noqa: E402
+
+DATE = datetime.datetime(2026, 10, 18, 14, 35)
+ARGS = ("NEXT-MONTH", DATE.year, DATE.month, DATE.day, DATE.hour, DATE.minute)
+
+
+def legacy_encode(action, year, month, day, hour, minute):
+    return messages.CALENDAR_CALLBACK + ";" + ";".join(
+        [action, str(year), str(month), str(day), str(hour), str(minute)]
+    )
+
+
+def timed(func, arg, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        func(*arg)
+    return (time.perf_counter() - started) / count * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    compact = telegramcalendar.create_callback_data(*ARGS)
+    legacy = legacy_encode(*ARGS)
+    rows = (
+        ("encode", timed(legacy_encode, ARGS, count), timed(telegramcalendar.create_callback_data, ARGS, count)),
+        ("decode", timed(telegramcalendar.parse_callback_data, (legacy,), count),
+         timed(telegramcalendar.parse_callback_data, (compact,), count)),
+        # Без кэша разбора: кнопка, которую ещё никто не нажимал
+        ("cold", timed(telegramcalendar.parse_callback_data.__wrapped__, (legacy,), count),
+         timed(telegramcalendar.parse_callback_data.__wrapped__, (compact,), count)),
+    )
+    print(f"{'':>8} {'legacy':>10} {'C1':>10}")
+    for name, old, new in rows:
+        print(f"{name:>8} {old:8.2f}мкс {new:8.2f}мкс")
+    print(f"{'bytes':>8} {len(legacy):10d} {len(compact):10d}   ({legacy!r} -> {compact!r})")
+
+    markup = telegramcalendar._build_calendar.__wrapped__(*ARGS[1:]).to_dict()
+    new_size = len(json.dumps(markup))
+    for row in markup["inline_keyboard"]:
+        for button in row:
+            action, date = telegramcalendar.parse_callback_data(button["callback_data"])
+            date = date or DATE.replace(day=1)
+            button["callback_data"] = legacy_encode(
+                action, date.year, date.month, 0 if action == "IGNORE" else date.day, date.hour, date.minute
+            )
+    print(f"{'markup':>8} {len(json.dumps(markup)):10d} {new_size:10d}   (JSON reply_markup календаря)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""Load test of the whole bot against a fake Bot API and an in-memory Mongo.
+
+Runs ``app.build_app()`` with ``BOT_API_URL`` pointed at ``fake_bot_api`` and
+replays synthetic workloads through the real update processor and handlers:
+
+* ``echo``      — N users each create a task from a text message;
+* ``calendar``  — every user opens the calendar on the task, pages it and picks a day;
+* ``reminders`` — M reminders due in the same minute go through ``pop_job``.
+
+It prints p50/p99 handler latency, throughput and Bot API calls per operation.
+Mongo is mongomock (``pip install -r bench/requirements.txt``) unless
+``--mongo-uri`` points at a real server — use a throwaway database.
+
+    python bench/bench_load.py --users 200 --reminders 500 --latency-ms 30 --rate-limit 0.01
+"""
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import logging
+import os
+import sys
+import time
+from typing import Dict, List
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import BOT_USER, FakeBotAPI  # noqa: E402
+
+USER_BASE = 10 ** 5
+REMINDER_CHAT_BASE = 2 * 10 ** 6
+REMINDER_MESSAGE_BASE = 3 * 10 ** 6
+_update_ids = itertools.count(1)
+_user_message_ids = itertools.count(1)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"u{uid}"}
+
+
+def text_update(uid: int, text: str) -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_user_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": _user(uid),
+            "text": text,
+        },
+    }
+
+
+def callback_update(api: FakeBotAPI, uid: int, message_id: int, data: str) -> dict:
+    shown = api.messages[(uid, message_id)]
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": uid, "type": "private"},
+        "from": BOT_USER,
+        "text": shown["text"],
+    }
+    if shown["reply_markup"]:
+        message["reply_markup"] = shown["reply_markup"]
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(uid),
+            "chat_instance": "bench",
+            "data": data,
+            "message": message,
+        },
+    }
+
+
+def _keyboard(api: FakeBotAPI, uid: int, message_id) -> list:
+    shown = api.messages.get((uid, message_id)) or {}
+    return (shown.get("reply_markup") or {}).get("inline_keyboard") or []
+
+
+class Phase:
+    def __init__(self, name: str, api: FakeBotAPI) -> None:
+        self.name = name
+        self.api = api
+        self.latencies: Dict[str, List[float]] = {}
+        self.ops = 0
+        # Сценарии, прерванные из-за ошибки бота (например, после 429 обработчик не повторяет вызов)
+        self.errors = 0
+
+    def __enter__(self) -> "Phase":
+        self.calls_before = self.api.snapshot()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.elapsed = time.perf_counter() - self.started
+        self.calls = self.api.snapshot() - self.calls_before
+
+    def report(self) -> None:
+        print(f"\n== {self.name}: {self.ops} операций за {self.elapsed:.2f}s ({self.ops / self.elapsed:.1f}/s)")
+        for kind, values in self.latencies.items():
+            print(
+                f"   {kind:<10} n={len(values):<6} p50={percentile(values, 0.5) * 1000:8.1f}ms"
+                f"   p99={percentile(values, 0.99) * 1000:8.1f}ms"
+            )
+        if self.errors:
+            print(f"   прервано сценариев: {self.errors}")
+        total = sum(self.calls.values())
+        per_op = ", ".join(f"{method}={count / self.ops:.2f}" for method, count in self.calls.most_common())
+        print(f"   вызовов API на операцию: {total / max(self.ops, 1):.2f} ({per_op})")
+
+
+async def feed(tg_app, payload: dict) -> float:
+    """Push one update through the bot's update processor; return its handling time."""
+    from telegram import Update
+
+    update = Update.de_json(payload, tg_app.bot)
+    started = time.perf_counter()
+    await tg_app.update_processor.process_update(update, tg_app.process_update(update))
+    return time.perf_counter() - started
+
+
+async def phase_echo(tg_app, api: FakeBotAPI, users: List[int]) -> Phase:
+    with Phase("echo", api) as phase:
+        latencies = await asyncio.gather(*(feed(tg_app, text_update(uid, f"task {uid}")) for uid in users))
+        phase.latencies["echo"] = list(latencies)
+        phase.ops = len(users)
+    return phase
+
+
+async def phase_calendar(tg_app, api: FakeBotAPI, users: List[int], clicks: int) -> Phase:
+    async def user_flow(uid: int, phase: Phase) -> None:
+        task_id = api.last_sent.get(uid)
+        if not _keyboard(api, uid, task_id):
+            phase.errors += 1
+            return
+        phase.latencies["date"].append(await feed(tg_app, callback_update(api, uid, task_id, "date")))
+        calendar_id = api.last_sent[uid]
+        for _ in range(clicks):
+            keyboard = _keyboard(api, uid, calendar_id)
+            if calendar_id == task_id or not keyboard:
+                phase.errors += 1
+                return
+            # Строка минут — предпоследняя, ">" — третья кнопка
+            data = keyboard[-2][2]["callback_data"]
+            phase.latencies["nav"].append(await feed(tg_app, callback_update(api, uid, calendar_id, data)))
+        day = next(
+            (
+                button["callback_data"]
+                for row in _keyboard(api, uid, calendar_id)
+                for button in row
+                if button["text"] == "28"
+            ),
+            None,
+        )
+        if calendar_id == task_id or day is None:
+            phase.errors += 1
+            return
+        phase.latencies["day"].append(await feed(tg_app, callback_update(api, uid, calendar_id, day)))
+
+    with Phase("calendar", api) as phase:
+        phase.latencies = {"date": [], "nav": [], "day": []}
+        await asyncio.gather(*(user_flow(uid, phase) for uid in users))
+        phase.ops = sum(len(values) for values in phase.latencies.values())
+    return phase
+
+
+async def phase_reminders(api: FakeBotAPI, count: int, chats: int, timeout: float) -> Phase:
+    import db
+    import metrics
+    from scheduler import reminder_queue
+    from sendqueue import send_queue
+
+    due = db.due_fields(datetime.datetime.now() - datetime.timedelta(minutes=1))
+    docs = [
+        {
+            "chat_id": REMINDER_CHAT_BASE + i % chats,
+            "message_id": REMINDER_MESSAGE_BASE + i,
+            "message": "bench",
+            "caption": None,
+            "today": "",
+            **due,
+        }
+        for i in range(count)
+    ]
+    db.mongo.collection.insert_many(docs)
+    failed_before = metrics.reminders_failed.value()
+    done_before = metrics.trigger_delay.count() + failed_before
+    with Phase("reminders", api) as phase:
+        for doc in docs:
+            reminder_queue.push(doc["chat_id"], doc["message_id"], doc["due_at"])
+        deadline = time.monotonic() + timeout
+        # Фаза заканчивается вместе с тиком: после отправок идут deleteMessages и сброс буфера
+        while (
+            metrics.trigger_delay.count() + metrics.reminders_failed.value() - done_before < count
+            or reminder_queue._running
+            or send_queue.depth
+        ):
+            if time.monotonic() > deadline:
+                print(f"   ! не дождались всех напоминаний за {timeout}s")
+                break
+            await asyncio.sleep(0.01)
+        phase.ops = count
+    phase.failed = metrics.reminders_failed.value() - failed_before
+    return phase
+
+
+async def run(args, api: FakeBotAPI) -> List[Phase]:
+    import app
+
+    tg_app = app.build_app()
+    users = [USER_BASE + i for i in range(args.users)]
+    async with tg_app:
+        await tg_app.start()
+        await app._post_init(tg_app)
+        # Расписание и состояния загружаются в фоне, как только ответит Mongo
+        await app._storage_task
+        try:
+            phases = [await phase_echo(tg_app, api, users)]
+            phases.append(await phase_calendar(tg_app, api, users, args.clicks))
+            phases.append(
+                await phase_reminders(api, args.reminders, args.reminder_chats or args.reminders, args.timeout)
+            )
+        finally:
+            await tg_app.stop()
+            await app._post_shutdown(tg_app)
+    return phases
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--clicks", type=int, default=5, help="кликов навигации календаря на пользователя")
+    parser.add_argument("--reminders", type=int, default=200, help="напоминаний с одним сроком")
+    parser.add_argument("--reminder-chats", type=int, default=0, help="в скольких чатах (0 — у каждого свой)")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="задержка ответа fake Bot API")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--send-rate", type=float, default=30.0, help="SEND_RATE_GLOBAL")
+    parser.add_argument("--mongo-uri", default="", help="реальный MongoDB вместо mongomock")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    api = FakeBotAPI(latency=args.latency_ms / 1000, rate_limit_ratio=args.rate_limit)
+    os.environ.update(
+        TOKEN="123456:bench",
+        BOT_API_URL=api.start(port=args.port),
+        METRICS_ENABLED="false",
+        SEND_RATE_GLOBAL=str(args.send_rate),
+        COLLECTION_NAME="bench_reminders",
+    )
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("mongomock не установлен: pip install -r bench/requirements.txt или --mongo-uri")
+        import pymongo
+
+        pymongo.MongoClient = mongomock.MongoClient
+
+    os.chdir(ROOT)
+    import app  # noqa: F401  (настраивает TZ и логирование)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    try:
+        phases = asyncio.run(run(args, api))
+    finally:
+        api.stop()
+    print(
+        f"пользователей={args.users} кликов={args.clicks} напоминаний={args.reminders} "
+        f"latency={args.latency_ms}ms 429={args.rate_limit:.1%} send_rate={args.send_rate}/s"
+    )
+    for phase in phases:
+        phase.report()
+    reminders = phases[-1]
+    print(f"   напоминаний в секунду: {reminders.ops / reminders.elapsed:.1f}, с ошибкой: {reminders.failed:.0f}")
+    if api.rate_limited:
+        print(f"\n429 отдано: {sum(api.rate_limited.values())} ({dict(api.rate_limited)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Cold-start budget: import time of ``app`` and time to the first handled update.
+
+Two measurements, each in fresh processes:
+
+* ``import``       — ``python -X importtime -c "import app"``: wall time of the
+  import and the top-level packages that take the most import time;
+* ``first update`` — ``python app.py`` in long polling mode against
+  ``fake_bot_api``: time from process start to the first ``getUpdates`` and to
+  the reply to a queued text message.
+
+Mongo is mongomock (``pip install -r bench/requirements.txt``) unless
+``--mongo-uri`` is given; its own import is included in "first update". Exits
+with status 1 when a median exceeds its budget, so it can guard CI.
+
+    python bench/bench_startup.py --runs 5 --import-budget-ms 1500 --first-update-budget-ms 4000
+"""
+
+import argparse
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Tuple
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_load import text_update  # noqa: E402
+from fake_bot_api import FakeBotAPI  # noqa: E402
+
+USER_BASE = 7 * 10 ** 5
+_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+\d+ \| *(\S+)")
+
+# Бот под mongomock: подменяем клиент до импорта db
+_CHILD_MONGOMOCK = (
+    "import runpy, sys, mongomock, pymongo; "
+    "pymongo.MongoClient = mongomock.MongoClient; "
+    "sys.argv = ['app.py']; "
+    "runpy.run_path('app.py', run_name='__main__')"
+)
+
+
+def _env(**overrides: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("TOKEN", "123456:bench")
+    env.setdefault("DB_NAME", "bench")
+    env.setdefault("COLLECTION_NAME", "bench_startup")
+    env.setdefault("MONGO_HOST", "localhost")
+    env.update(overrides)
+    return env
+
+
+def measure_import(runs: int) -> Tuple[List[float], Counter]:
+    """Wall time of ``import app`` per run and import ms per top-level package (last run)."""
+    walls = []
+    packages: Counter = Counter()
+    for _ in range(runs):
+        started = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import app"],
+            cwd=ROOT, env=_env(METRICS_ENABLED="false"), capture_output=True, text=True,
+        )
+        walls.append(time.perf_counter() - started)
+        if proc.returncode:
+            sys.exit(f"import app упал:\n{proc.stderr[-2000:]}")
+        packages = Counter()
+        for line in proc.stderr.splitlines():
+            match = _IMPORTTIME.match(line)
+            if match:
+                # Собственное время модулей, сложенное по пакету верхнего уровня
+                packages[match.group(2).split(".")[0]] += int(match.group(1)) / 1000
+    return walls, packages
+
+
+def measure_first_update(api: FakeBotAPI, url: str, run: int, args) -> Tuple[float, float]:
+    """Seconds from process start to the first ``getUpdates`` and to the reply."""
+    uid = USER_BASE + run
+    api.first_call.pop("getUpdates", None)
+    api.push_update(text_update(uid, f"startup {run}"))
+    if args.mongo_uri:
+        command, env = [sys.executable, "app.py"], _env(MONGO_URI=args.mongo_uri)
+    else:
+        command, env = [sys.executable, "-c", _CHILD_MONGOMOCK], _env()
+    # Как в проде: long polling и сервер /metrics рядом
+    env.update(BOT_API_URL=url, WEBHOOK_MODE="false", LISTEN_HOST="127.0.0.1", PORT=str(args.metrics_port))
+    started = time.monotonic()
+    proc = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        while uid not in api.last_sent:
+            if proc.poll() is not None:
+                sys.exit(f"бот завершился до ответа:\n{proc.stderr.read().decode()[-2000:]}")
+            if time.monotonic() - started > args.timeout:
+                sys.exit(f"бот не ответил за {args.timeout}s")
+            time.sleep(0.005)
+        replied = time.monotonic()
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.communicate(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+    return api.first_call["getUpdates"] - started, replied - started
+
+
+def _ms(values: List[float]) -> str:
+    return f"median={statistics.median(values) * 1000:7.1f}ms  min={min(values) * 1000:7.1f}ms"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="сколько самых медленных пакетов показать")
+    parser.add_argument("--import-budget-ms", type=float, default=0, help="0 — не проверять")
+    parser.add_argument("--first-update-budget-ms", type=float, default=0, help="0 — не проверять")
+    parser.add_argument("--mongo-uri", default="", help="реальный MongoDB вместо mongomock")
+    parser.add_argument("--port", type=int, default=8788, help="порт fake Bot API")
+    parser.add_argument("--metrics-port", type=int, default=8789, help="порт /metrics бота")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    if not args.mongo_uri:
+        try:
+            import mongomock  # noqa: F401
+        except ImportError:
+            sys.exit("mongomock не установлен: pip install -r bench/requirements.txt или --mongo-uri")
+
+    walls, packages = measure_import(args.runs)
+    print(f"import app:      {_ms(walls)}  (процесс целиком, {args.runs} запусков)")
+    for name, ms in packages.most_common(args.top):
+        print(f"   {name:<24} {ms:7.1f}ms")
+
+    api = FakeBotAPI()
+    url = api.start(port=args.port)
+    try:
+        polled, replied = zip(
+            *(measure_first_update(api, url, run, args) for run in range(args.runs))
+        )
+    finally:
+        api.stop()
+    print(f"first getUpdates: {_ms(list(polled))}")
+    print(f"first reply:      {_ms(list(replied))}")
+
+    failed = []
+    if args.import_budget_ms and statistics.median(walls) * 1000 > args.import_budget_ms:
+        failed.append(f"import app > {args.import_budget_ms:.0f}ms")
+    if args.first_update_budget_ms and statistics.median(replied) * 1000 > args.first_update_budget_ms:
+        failed.append(f"first reply > {args.first_update_budget_ms:.0f}ms")
+    if failed:
+        print(f"Бюджет превышен: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Local stand-in for the Telegram Bot API used by the load benchmarks.
+
+Answers every method the bot uses with a plausible result, records the calls
+and the markup of each message it "sent", and can add latency and inject
+429 Too Many Requests responses. Updates queued with ``push_update`` are
+served to long polling (``getUpdates``). It runs its own uvicorn in a thread, so its
+event loop does not compete with the bot under test.
+"""
+
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import ClientDisconnect, Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.0, rate_limit_ratio: float = 0.0, retry_after: int = 1) -> None:
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.calls: Counter = Counter()
+        self.rate_limited: Counter = Counter()
+        # (chat_id, message_id) -> {"text": ..., "reply_markup": ...}
+        self.messages: Dict[Tuple[int, int], dict] = {}
+        self.last_sent: Dict[int, int] = {}
+        # Когда (time.monotonic()) каждый метод вызвали впервые
+        self.first_call: Dict[str, float] = {}
+        self._updates: List[dict] = []
+        self._ids = itertools.count(10 ** 6)
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+        self._server: Optional[uvicorn.Server] = None
+        self._thread: Optional[threading.Thread] = None
+        self.app = Starlette(routes=[Route("/bot{token}/{method}", self._handle, methods=["POST"])])
+
+    def push_update(self, update: dict) -> None:
+        """Queue an update for the next ``getUpdates``."""
+        with self._lock:
+            self._updates.append(update)
+
+    def snapshot(self) -> Counter:
+        with self._lock:
+            return Counter(self.calls)
+
+    def _message(self, chat_id: int, params: dict) -> dict:
+        message_id = next(self._ids)
+        with self._lock:
+            self.messages[(chat_id, message_id)] = {
+                "text": params.get("text"),
+                "reply_markup": params.get("reply_markup"),
+            }
+            self.last_sent[chat_id] = message_id
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text") or "",
+        }
+
+    def _result(self, method: str, params: dict):
+        chat_id = int(params.get("chat_id", 0) or 0)
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            offset = int(params.get("offset") or 0)
+            with self._lock:
+                self._updates = [u for u in self._updates if u["update_id"] >= offset]
+                return list(self._updates)
+        if method == "sendMessage":
+            return self._message(chat_id, params)
+        if method == "copyMessage":
+            return {"message_id": self._message(chat_id, params)["message_id"]}
+        if method in ("editMessageText", "editMessageCaption"):
+            key = (chat_id, int(params["message_id"]))
+            with self._lock:
+                self.messages[key] = {"text": params.get("text"), "reply_markup": params.get("reply_markup")}
+            return {
+                "message_id": key[1],
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text") or "",
+            }
+        return True
+
+    async def _handle(self, request: Request) -> Response:
+        method = request.path_params["method"]
+        try:
+            body = await request.body()
+        except ClientDisconnect:
+            # Бот остановлен посреди запроса (bench_startup)
+            return Response(status_code=499)
+        if request.headers.get("content-type", "").startswith("application/json"):
+            params = json.loads(body)
+        else:
+            # Без файлов PTB шлёт urlencoded-форму, сложные значения — строками JSON
+            params = {}
+            for key, value in urllib.parse.parse_qsl(body.decode()):
+                try:
+                    params[key] = json.loads(value)
+                except (TypeError, ValueError):
+                    params[key] = value
+        with self._lock:
+            self.calls[method] += 1
+            self.first_call.setdefault(method, time.monotonic())
+            limited = method != "getMe" and self._random.random() < self.rate_limit_ratio
+            if limited:
+                self.rate_limited[method] += 1
+        if method == "getUpdates" and not self._updates:
+            # Long polling: пустой ответ не сразу, чтобы бот не крутился в цикле
+            await asyncio.sleep(0.1)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if limited:
+            return JSONResponse(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                },
+                status_code=429,
+            )
+        return JSONResponse({"ok": True, "result": self._result(method, params)})
+
+    def start(self, host: str = "127.0.0.1", port: int = 8787) -> str:
+        """Serve in a background thread; return the ``BOT_API_URL`` to use."""
+        self._server = uvicorn.Server(uvicorn.Config(self.app, host=host, port=port, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, name="fake-bot-api", daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return f"http://{host}:{port}/bot"
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join()
@@ -1,74 +1,613 @@
+import asyncio
+import datetime
+import functools
 import logging
-from typing import List
-from pymongo import MongoClient, errors
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
+from pymongo import ASCENDING, DeleteMany, DeleteOne, IndexModel, MongoClient, ReplaceOne, UpdateOne, errors
+
+import metrics
 from config import settings
+from profiling import profiler
 
 logger = logging.getLogger(__name__)
 
+# Формат строкового поля ``date`` (его же показываем пользователю)
+DATE_FORMAT = "%d-%m-%Y %H:%M"
+MIGRATION_BATCH_SIZE = 1000
+# Через сколько повторить пакет записи, который Mongo не приняла
+WRITE_RETRY_SECONDS = 5
+# Через сколько после due_at напоминание удаляется TTL-индексом
+REMINDER_TTL = datetime.timedelta(days=1)
 
-def _get_collection():
-    """Initialize connection to MongoDB and return the collection."""
 
-    try:
+# Индексы, на которые опираются запросы бота
+INDEXES = [
+    IndexModel([("chat_id", ASCENDING), ("message_id", ASCENDING)], name="chat_message", unique=True),
+    IndexModel([("due_at", ASCENDING)], name="due_at"),
+    # Просроченные напоминания удаляет сам Mongo (фоновый TTL-монитор, раз в минуту)
+    IndexModel([("expires_at", ASCENDING)], name="expires_at", expireAfterSeconds=0),
+]
+# Таймеры JobQueue, переживающие рестарт (jobstore.py)
+JOB_INDEXES = [IndexModel([("kind", ASCENDING), ("run_at", ASCENDING)], name="kind_run_at")]
+
+
+def ensure_indexes(coll, indexes: List[IndexModel] = INDEXES) -> bool:
+    """Create every index from ``indexes`` that the collection lacks.
+
+    Indexes are created one by one so that a failure (e.g. duplicates blocking
+    the unique index) does not prevent the others from being built. Returns
+    whether all of them exist now.
+    """
+    built = True
+    for index in indexes:
+        try:
+            coll.create_indexes([index])
+        except errors.OperationFailure as exc:
+            logger.error("Не удалось создать индекс %s: %s", index.document["name"], exc)
+            built = False
+    return built
+
+
+def dedupe_reminders(coll) -> int:
+    """Drop duplicate ``(chat_id, message_id)`` records that block the unique index.
+
+    The old count-then-insert path could store a reminder twice; the most
+    recently inserted copy is kept. Runs only while the ``chat_message`` index
+    is missing. Returns the number of removed records.
+    """
+    if "chat_message" in coll.index_information():
+        return 0
+    groups = coll.aggregate(
+        [
+            {"$group": {
+                "_id": {"chat_id": "$chat_id", "message_id": "$message_id"},
+                "ids": {"$push": "$_id"},
+                "count": {"$sum": 1},
+            }},
+            {"$match": {"count": {"$gt": 1}}},
+        ],
+        allowDiskUse=True,
+    )
+    removed = 0
+    extra: List = []
+    for group in groups:
+        # ObjectId растёт со временем вставки — оставляем последнюю копию
+        extra += sorted(group["ids"])[:-1]
+        if len(extra) >= MIGRATION_BATCH_SIZE:
+            removed += coll.delete_many({"_id": {"$in": extra}}).deleted_count
+            extra = []
+    if extra:
+        removed += coll.delete_many({"_id": {"$in": extra}}).deleted_count
+    if removed:
+        logger.warning("Удалено дублей (chat_id, message_id): %d", removed)
+    return removed
+
+
+class MongoConnection:
+    """Lazily created ``MongoClient`` with a readiness probe.
+
+    Nothing touches the network at import time: the client is created on first
+    use (pymongo itself connects and reconnects in the background), and
+    :meth:`watch` pings the server, builds the indexes once it answers (retrying
+    on later pings until every index exists) and keeps :attr:`ready` up to date
+    for the ``/ready`` probe.
+    """
+
+    def __init__(self) -> None:
+        self.ready = False
+        self.last_error: Optional[str] = None
+        self._client: Optional[MongoClient] = None
+        self._collection = None
+        self._indexes_ready = False
+        self._lock = threading.Lock()
+        self._ready_event: Optional[asyncio.Event] = None
+
+    @staticmethod
+    def client_options() -> dict:
+        """Pool, timeout, compression and concern options from ``settings``."""
+        options = {
+            "serverSelectionTimeoutMS": settings.MONGO_CONNECT_TIMEOUT_MS,
+            "connectTimeoutMS": settings.MONGO_CONNECT_TIMEOUT_MS,
+            "socketTimeoutMS": settings.MONGO_TIMEOUT_MS,
+            # Запросы идут только из пула потоков: больше соединений, чем потоков, не нужно
+            "maxPoolSize": settings.MONGO_MAX_POOL_SIZE or settings.MONGO_EXECUTOR_WORKERS,
+            "minPoolSize": settings.MONGO_MIN_POOL_SIZE,
+        }
+        if settings.MONGO_MAX_IDLE_TIME_MS:
+            options["maxIdleTimeMS"] = settings.MONGO_MAX_IDLE_TIME_MS
+        if settings.MONGO_COMPRESSORS:
+            options["compressors"] = settings.MONGO_COMPRESSORS
+        if settings.MONGO_WRITE_CONCERN:
+            concern = settings.MONGO_WRITE_CONCERN
+            options["w"] = int(concern) if concern.isdigit() else concern
+        if settings.MONGO_READ_CONCERN:
+            options["readConcernLevel"] = settings.MONGO_READ_CONCERN
+        return options
+
+    def _create_client(self) -> MongoClient:
         if settings.MONGO_URI:
             # Предпочтительно подключаемся по URI (с репликасетом/параметрами/SSL и т.д.)
-            client = MongoClient(settings.MONGO_URI, serverSelectionTimeoutMS=30000)
-            client.server_info()  # проверка соединения/аутентификации
-        else:
-            # Хост/порт + authSource
-            if not settings.MONGO_HOST:
-                raise ValueError("MONGO_HOST is empty and MONGO_URI not provided")
-            client = MongoClient(
-                host=settings.MONGO_HOST,
-                port=settings.MONGO_PORT,
-                username=settings.MONGO_USER or None,
-                password=settings.MONGO_PASS or None,
-                authSource=settings.MONGO_AUTH_DB,
-                serverSelectionTimeoutMS=30000,
-            )
-            client.server_info()
+            return MongoClient(settings.MONGO_URI, **self.client_options())
+        # Хост/порт + authSource
+        if not settings.MONGO_HOST:
+            raise errors.ConfigurationError("MONGO_HOST is empty and MONGO_URI not provided")
+        return MongoClient(
+            host=settings.MONGO_HOST,
+            port=settings.MONGO_PORT,
+            username=settings.MONGO_USER or None,
+            password=settings.MONGO_PASS or None,
+            authSource=settings.MONGO_AUTH_DB,
+            **self.client_options(),
+        )
+
+    @property
+    def collection(self):
+        """The reminders collection; creates the client on first access."""
+        if self._collection is None:
+            with self._lock:
+                if self._collection is None:
+                    self._client = self._create_client()
+                    self._collection = self._client[settings.DB_NAME][settings.COLLECTION_NAME]
+        return self._collection
+
+    def ping(self) -> None:
+        """Blocking round-trip to the server; builds the indexes until all of them exist."""
+        coll = self.collection
+        coll.database.client.admin.command("ping")
+        if not self._indexes_ready:
+            # Дубли из старых баз не дают построить уникальный индекс — сначала убираем их
+            dedupe_reminders(coll)
+            built = ensure_indexes(coll)
+            built = ensure_indexes(coll.database[settings.JOB_COLLECTION_NAME], JOB_INDEXES) and built
+            if built:
+                self._indexes_ready = True
+                logger.info("Mongo connected: db=%s collection=%s", settings.DB_NAME, settings.COLLECTION_NAME)
+
+    def _event(self) -> asyncio.Event:
+        if self._ready_event is None:
+            self._ready_event = asyncio.Event()
+        return self._ready_event
+
+    async def wait_ready(self) -> None:
+        """Wait until the first successful ping."""
+        await self._event().wait()
+
+    async def watch(self, interval: float) -> None:
+        """Ping the server every ``interval`` seconds and track readiness."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(_executor, self.ping)
+            except Exception as exc:  # pragma: no cover - logging only
+                if self.ready or self.last_error is None:
+                    logger.error("Ошибка подключения к Mongo: %s", exc)
+                self.ready = False
+                self.last_error = str(exc)
+            else:
+                if not self.ready and self.last_error is not None:
+                    logger.warning("Mongo снова доступен")
+                self.ready = True
+                self.last_error = None
+                self._event().set()
+            await asyncio.sleep(interval)
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+
+
+mongo = MongoConnection()
+
+# pymongo синхронный: все запросы уводим в отдельный пул потоков,
+# чтобы медленный Mongo не блокировал event loop бота
+_executor = ThreadPoolExecutor(
+    max_workers=settings.MONGO_EXECUTOR_WORKERS, thread_name_prefix="mongo"
+)
+
+
+def _offload(func):
+    """Turn a blocking pymongo helper into a coroutine run on the Mongo executor."""
+
+    op = func.__name__.lstrip("_")
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        try:
+            with metrics.mongo_latency.time(op), profiler.span(f"db.{op}"):
+                return await asyncio.wait_for(
+                    loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs)),
+                    timeout=settings.MONGO_TIMEOUT_MS / 1000,
+                )
+        except Exception as exc:
+            metrics.mongo_errors.inc(op, type(exc).__name__)
+            raise
+
+    return wrapper
+
+
+# Подписчики на изменения расписания: listener(chat_id, message_id, due_at).
+# due_at=None — напоминание для message_id в chat_id больше не ждём.
+_schedule_listeners: List[Callable[[int, int, Optional[datetime.datetime]], None]] = []
+
+
+def subscribe(listener: Callable[[int, int, Optional[datetime.datetime]], None]) -> None:
+    """Register a callback notified after reminder due times change."""
+    _schedule_listeners.append(listener)
+
+
+def _notify(chat_id, message_id, due_at: Optional[datetime.datetime]) -> None:
+    for listener in _schedule_listeners:
+        try:
+            listener(chat_id, message_id, due_at)
+        except Exception as exc:  # pragma: no cover - logging only
+            logger.warning("Ошибка подписчика расписания: %s", exc)
+
+
+def shutdown() -> None:
+    """Wait for in-flight Mongo calls, stop the executor and close the client."""
+    _executor.shutdown(wait=True)
+    mongo.close()
+
+
+@_offload
+def _upsert_reminder(chat_id: int, message_id: int, data: dict, on_insert: dict) -> None:
+    collection = mongo.collection
+    selector = {"chat_id": chat_id, "message_id": message_id}
+    update = {"$set": data, "$setOnInsert": on_insert}
+    try:
+        collection.update_one(selector, update, upsert=True)
+    except errors.DuplicateKeyError:
+        # Параллельный upsert успел вставить документ — теперь это обычный update
+        collection.update_one(selector, update)
+
+
+async def upsert_reminder(chat_id: int, message_id: int, data: dict, on_insert: dict) -> None:
+    """Set ``data`` on the reminder of a message, creating it with ``on_insert`` if missing.
 
-        db = client[settings.DB_NAME]
-        coll = db[settings.COLLECTION_NAME]
-        logger.info("Mongo connected: db=%s collection=%s", settings.DB_NAME, settings.COLLECTION_NAME)
-        return coll
+    One round-trip; the unique ``(chat_id, message_id)`` index rules out duplicates.
+    """
+    await write_buffer.flush()
+    await _upsert_reminder(chat_id, message_id, data, on_insert)
+    if data.get("due_at"):
+        _notify(chat_id, message_id, data["due_at"])
 
-    except (errors.PyMongoError, Exception) as exc:  # pragma: no cover - logging only
-        logger.error("Ошибка подключения к Mongo: %s", exc)
-        return None
+
+@_offload
+def _bulk_write(ops: list) -> None:
+    mongo.collection.bulk_write(ops, ordered=False)
+
+
+class WriteBuffer:
+    """Write-behind buffer that turns many reminder writes into one ``bulk_write``.
+
+    Updates to the same ``(chat_id, message_id)`` are merged; the buffer is
+    flushed when it holds ``max_ops`` operations, ``max_delay`` seconds after
+    the first buffered write, on shutdown, or before any direct write or read
+    so callers always see their own changes. A batch Mongo did not accept is
+    kept and retried every ``WRITE_RETRY_SECONDS``, ahead of newer batches.
+    """
+
+    def __init__(self, max_ops: int, max_delay: float) -> None:
+        self.max_ops = max_ops
+        self.max_delay = max_delay
+        # message_id уникален только внутри чата — ключ всегда (chat_id, message_id)
+        self._updates: Dict[Tuple[int, int], dict] = {}
+        self._renamed: Dict[Tuple[int, int], Tuple[int, int]] = {}  # новый ключ -> ключ в _updates
+        self._deletes: List[dict] = []
+        # Пачки, которые не удалось записать, — в порядке сброса
+        self._unwritten: List[list] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._lock: Optional[asyncio.Lock] = None
+        # Ссылки на фоновые flush, иначе задачу может собрать GC до завершения
+        self._tasks: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return self._buffered() + sum(len(ops) for ops in self._unwritten)
+
+    def _buffered(self) -> int:
+        return len(self._updates) + len(self._deletes)
+
+    def update(self, chat_id: int, message_id: int, data: dict) -> None:
+        """Buffer ``$set: data`` for the reminder of ``message_id`` in ``chat_id``."""
+        key = self._renamed.get((chat_id, message_id), (chat_id, message_id))
+        self._updates.setdefault(key, {}).update(data)
+        new_id = data.get("message_id", message_id)
+        if new_id != message_id:
+            self._renamed.pop((chat_id, message_id), None)
+            self._renamed[(chat_id, new_id)] = key
+            _notify(chat_id, message_id, None)
+        if data.get("due_at"):
+            _notify(chat_id, new_id, data["due_at"])
+        self._schedule()
+
+    def delete(self, filter_dict: dict) -> None:
+        """Buffer ``delete_many(filter_dict)``."""
+        chat_id, message_id = filter_dict.get("chat_id"), filter_dict.get("message_id")
+        if isinstance(chat_id, int) and isinstance(message_id, int):
+            key = self._renamed.pop((chat_id, message_id), (chat_id, message_id))
+            if self._updates.pop(key, None) is not None:
+                # Незаписанное обновление больше не нужно — удаляем по исходному id
+                filter_dict = {**filter_dict, "message_id": key[1]}
+            _notify(chat_id, message_id, None)
+        self._deletes.append(filter_dict)
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self._buffered() >= self.max_ops:
+            self._flush_in_background()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush_in_background)
+
+    def _flush_in_background(self) -> None:
+        task = asyncio.get_running_loop().create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self) -> None:
+        """Write all buffered operations with one unordered ``bulk_write``.
+
+        Also waits for a flush already in flight, so a direct write issued
+        after ``flush()`` never overtakes buffered ones. Batches left from
+        failed flushes are written first; if Mongo fails again, the rest stays
+        buffered for the retry.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if not len(self) and not self._lock.locked():
+            return
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            ops = [
+                UpdateOne({"chat_id": chat_id, "message_id": message_id}, {"$set": data})
+                for (chat_id, message_id), data in self._updates.items()
+            ]
+            ops += [DeleteMany(filter_dict) for filter_dict in self._deletes]
+            self._updates, self._renamed, self._deletes = {}, {}, []
+            if ops:
+                self._unwritten.append(ops)
+            # Пачки пишем строго по очереди: более поздняя может обновлять документ
+            # по message_id, который ему присвоила предыдущая. Повтор безопасен —
+            # $set и удаление по фильтру можно применить дважды
+            while self._unwritten:
+                try:
+                    await _bulk_write(self._unwritten[0])
+                except Exception:
+                    logger.exception(
+                        "Ошибка пакетной записи (%d операций), повтор через %d с",
+                        len(self), WRITE_RETRY_SECONDS,
+                    )
+                    if self._timer is None:
+                        self._timer = asyncio.get_running_loop().call_later(
+                            WRITE_RETRY_SECONDS, self._flush_in_background
+                        )
+                    return
+                self._unwritten.pop(0)
+
+
+write_buffer = WriteBuffer(
+    max_ops=settings.WRITE_BUFFER_MAX_OPS,
+    max_delay=settings.WRITE_BUFFER_MAX_DELAY_MS / 1000,
+)
+
+
+def due_fields(date: datetime.datetime) -> dict:
+    """Return the stored date fields for a reminder due at ``date``.
+
+    ``date`` keeps the legacy string representation, ``due_at`` is the native
+    BSON datetime the scheduler queries on and ``expires_at`` drives the TTL index.
+    """
+    due_at = date.replace(second=0, microsecond=0)
+    return {"date": date.strftime(DATE_FORMAT), "due_at": due_at, "expires_at": _expires_at(due_at)}
+
+
+def _expires_at(due_at: datetime.datetime) -> datetime.datetime:
+    # due_at хранится в локальном времени, а TTL-монитор сравнивает с UTC
+    return (due_at + REMINDER_TTL).astimezone(datetime.timezone.utc)
+
+
+@_offload
+def claim_due_reminders(
+    start: datetime.datetime,
+    now: datetime.datetime,
+    owner: str,
+    lease_until: datetime.datetime,
+    limit: int,
+) -> List[dict]:
+    """Atomically lease up to ``limit`` due reminders for ``owner``.
+
+    A reminder is claimable when ``start <= due_at <= now`` and it has no live
+    lease, so several bot replicas never fire the same reminder twice and
+    leases of a dead replica expire by themselves. ``owner`` must be unique per
+    call: it is how the claimed records are read back. Costs three round-trips
+    regardless of ``limit``.
+    """
+    collection = mongo.collection
+    free = {
+        "due_at": {"$gte": start, "$lte": now},
+        "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}],
+    }
+    ids = [
+        rec["_id"]
+        for rec in collection.find(free, {"_id": 1}).sort("due_at", ASCENDING).limit(limit)
+    ]
+    metrics.records_scanned.inc(amount=len(ids))
+    if not ids:
+        return []
+    # update_many заново проверяет условие для каждого документа, поэтому
+    # запись, которую успела захватить другая реплика, к нам уже не попадёт
+    collection.update_many(
+        {"_id": {"$in": ids}, **free},
+        {"$set": {"lease_owner": owner, "lease_until": lease_until}},
+    )
+    claimed = list(
+        collection.find(
+            {"_id": {"$in": ids}, "lease_owner": owner},
+            {"_id": 0, "chat_id": 1, "message_id": 1, "due_at": 1},
+        )
+    )
+    metrics.records_due.inc(amount=len(claimed))
+    return claimed
+
+
+def release_fields() -> dict:
+    """Return the fields that drop a scheduler lease."""
+    return {"lease_owner": None, "lease_until": None}
+
+
+@_offload
+def fetch_schedule(
+    start: datetime.datetime, end: datetime.datetime, limit: int = 0
+) -> List[Tuple[Tuple[int, int], datetime.datetime]]:
+    """Return up to ``limit`` earliest ``((chat_id, message_id), due_at)`` with ``start <= due_at <= end``."""
+    cursor = mongo.collection.find(
+        {"due_at": {"$gte": start, "$lte": end}},
+        {"_id": 0, "chat_id": 1, "message_id": 1, "due_at": 1},
+    ).sort("due_at", ASCENDING).limit(limit)
+    return [
+        ((rec["chat_id"], rec["message_id"]), rec["due_at"])
+        for rec in cursor
+        if rec.get("chat_id") and rec.get("message_id")
+    ]
+
+
+def _state_collection():
+    return mongo.collection.database[settings.STATE_COLLECTION_NAME]
+
+
+@_offload
+def fetch_user_states() -> Dict[int, dict]:
+    """Return persisted conversation states keyed by user id."""
+    coll = _state_collection()
+    return {rec.pop("_id"): rec for rec in coll.find()}
+
+
+@_offload
+def save_user_states(states: Dict[int, dict], deleted: List[int]) -> None:
+    """Replace the persisted states of ``states`` and drop those of ``deleted``."""
+    coll = _state_collection()
+    ops = [ReplaceOne({"_id": user_id}, fields, upsert=True) for user_id, fields in states.items()]
+    ops += [DeleteOne({"_id": user_id}) for user_id in deleted]
+    if ops:
+        coll.bulk_write(ops, ordered=False)
+
+
+def _job_collection():
+    return mongo.collection.database[settings.JOB_COLLECTION_NAME]
+
+
+@_offload
+def fetch_jobs(kind: str) -> List[dict]:
+    """Return persisted timers of ``kind`` ordered by ``run_at``."""
+    return list(_job_collection().find({"kind": kind}, {"_id": 0}).sort("run_at", ASCENDING))
+
+
+@_offload
+def save_jobs(ops: list) -> None:
+    """Apply buffered timer upserts and deletes in one unordered ``bulk_write``."""
+    _job_collection().bulk_write(ops, ordered=False)
+
+
+@_offload
+def _migrate_legacy_batch() -> Tuple[int, int]:
+    """Migrate up to ``MIGRATION_BATCH_SIZE`` legacy records; return ``(read, modified)``."""
+    collection = mongo.collection
+    ops = []
+    cursor = collection.find({"expires_at": {"$exists": False}}, {"date": 1, "due_at": 1})
+    for rec in cursor.limit(MIGRATION_BATCH_SIZE):
+        due_at = rec.get("due_at")
+        if due_at is None:
+            try:
+                due_at = datetime.datetime.strptime(rec.get("date") or "", DATE_FORMAT)
+            except ValueError as exc:
+                logger.warning("Некорректная дата '%s' у записи %s: %s", rec.get("date"), rec["_id"], exc)
+                fields = {"expires_at": _expires_at(datetime.datetime.now())}
+            else:
+                fields = {"due_at": due_at, "expires_at": _expires_at(due_at)}
+        else:
+            fields = {"expires_at": _expires_at(due_at)}
+        ops.append(UpdateOne({"_id": rec["_id"]}, {"$set": fields}))
+    if not ops:
+        return 0, 0
+    return len(ops), collection.bulk_write(ops, ordered=False).modified_count
 
 
-collection = _get_collection()
+async def migrate_legacy_dates() -> int:
+    """Fill ``due_at``/``expires_at`` for records written before these fields existed.
 
+    Records whose legacy ``date`` string cannot be parsed get only ``expires_at``,
+    so the TTL index removes them. Every batch is a separate executor call under
+    ``MONGO_TIMEOUT_MS``, so a large backlog has no overall deadline. Returns the
+    number of migrated records.
+    """
+    migrated = 0
+    while True:
+        # Мигрированные записи получают expires_at и в следующую выборку не попадают
+        read, modified = await _migrate_legacy_batch()
+        migrated += modified
+        if read < MIGRATION_BATCH_SIZE:
+            break
+    if migrated:
+        logger.info("Миграция дат: заполнено due_at/expires_at у %d записей", migrated)
+    return migrated
 
-def insert_reminder(record: dict) -> None:
-    """Insert a reminder record."""
-    if collection is not None:
-        collection.insert_one(record)
 
+def _query_shapes(now: datetime.datetime) -> Dict[str, Tuple[dict, Optional[list]]]:
+    """Representative ``(filter, sort)`` of every query the bot sends."""
+    lease_free = {"$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]}
+    return {
+        "write_buffer.update": ({"chat_id": 0, "message_id": 0}, None),
+        "upsert_reminder": ({"chat_id": 0, "message_id": 0}, None),
+        "write_buffer.delete": ({"chat_id": 0, "message_id": 0}, None),
+        "claim_due_reminders": (
+            {"due_at": {"$gte": now, "$lte": now}, **lease_free},
+            [("due_at", ASCENDING)],
+        ),
+        "fetch_schedule": ({"due_at": {"$gte": now, "$lte": now}}, [("due_at", ASCENDING)]),
+        "migrate_legacy_dates": ({"expires_at": {"$exists": False}}, None),
+    }
 
-def update_reminder(message_id: int, data: dict) -> None:
-    """Update reminder data for a specific message."""
-    if collection is not None:
-        collection.find_one_and_update({"message_id": message_id}, {"$set": data})
 
+def _plan_stages(plan: dict) -> List[str]:
+    """Collect the ``stage`` names of an explain() plan tree."""
+    stages = [plan["stage"]] if "stage" in plan else []
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += _plan_stages(child)
+    return stages
 
-def delete_reminders(filter_dict: dict) -> None:
-    """Delete reminders that match the given filter."""
-    if collection is not None:
-        collection.delete_many(filter_dict)
 
+def check_query_plans() -> Dict[str, List[str]]:
+    """Run ``explain()`` on every query shape and return the winning plan stages."""
+    collection = mongo.collection
+    plans = {}
+    for name, (filter_dict, sort) in _query_shapes(datetime.datetime.now()).items():
+        cursor = collection.find(filter_dict)
+        if sort:
+            cursor = cursor.sort(sort)
+        plans[name] = _plan_stages(cursor.explain()["queryPlanner"]["winningPlan"])
+    return plans
 
-def count_reminders(filter_dict: dict) -> int:
-    """Count reminders matching the filter."""
-    if collection is not None:
-        return collection.count_documents(filter_dict)
-    return 0
 
+if __name__ == "__main__":
+    # python db.py — проверка, что ни один запрос бота не сканирует всю коллекцию
+    import sys
 
-def fetch_reminders() -> List[dict]:
-    """Return all reminders stored in the collection."""
-    if collection is not None:
-        return list(collection.find())
-    return []
+    logging.basicConfig(format="%(levelname)s %(message)s", level=logging.INFO)
+    mongo.ping()
+    failed = []
+    for name, stages in check_query_plans().items():
+        status = "COLLSCAN" if "COLLSCAN" in stages else "ok"
+        print(f"{status:8} {name}: {' <- '.join(stages)}")
+        if status != "ok":
+            failed.append(name)
+    if failed:
+        print(f"Запросы без индекса: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
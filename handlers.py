@@ -1,20 +1,39 @@
 import asyncio
 import datetime
+import heapq
 import json
 import logging
+import time
+from typing import List, Optional, Tuple
 
 from telegram import ReplyKeyboardRemove, Update
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
 
 import messages
 import telegramcalendar
 import utils
-from db import count_reminders, delete_reminders, insert_reminder, update_reminder
+from db import due_fields, upsert_reminder, write_buffer
+from config import settings
+from jobstore import JobStore, job_store
+from metrics import callback_latency, echo_latency
+from profiling import profiler
+from render import edit_message, render_cache
+from router import CallbackRouter
+from state import create_store
 
 logger = logging.getLogger(__name__)
 
-# Глобальное хранилище состояний пользователей
-user_states: dict = {}
+# Хранилище состояний пользователей (LRU/TTL, опционально с сохранением в Mongo)
+user_states = create_store()
+
+# Нажатия inline-кнопок: callback_data разбирается один раз, обработчик — по таблице
+callback_router = CallbackRouter(callback_latency)
+for _prefix in telegramcalendar.CALLBACK_PREFIXES:
+    callback_router.add_parser(_prefix, telegramcalendar.parse_callback_data)
+
+# Сколько секунд ждём выбора даты в открытом календаре
+CALENDAR_TIMEOUT_SECONDS = 30
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -33,102 +52,201 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         logger.error("Ошибка в start: %s", exc)
 
 
-async def calendar_timeout(bot, chat_id, message_id, user_id):
-    """Удаляет календарь, если пользователь не выбрал дату вовремя."""
-    await asyncio.sleep(30)
-    state = user_states.get(user_id, {})
-    if state.get("data_message_id") == message_id and state.get("waiting_for_date"):
-        try:
-            await bot.delete_message(chat_id=chat_id, message_id=message_id)
-        except Exception as exc:  # pragma: no cover - logging only
-            logger.warning("Ошибка удаления сообщения календаря: %s", exc)
-        try:
-            await bot.send_message(chat_id=chat_id, text=messages.calendar_timeout)
-        except Exception as exc:  # pragma: no cover - logging only
-            logger.warning("Ошибка отправки сообщения тайм-аута: %s", exc)
-        user_states[user_id] = {}
+class CalendarSweeper:
+    """Deadline-ordered heap of open calendars, expired by a single JobQueue job.
+
+    Navigation only moves ``UserState.calendar_deadline`` forward and pushes a
+    new entry; entries whose deadline no longer matches the state are stale
+    and skipped when popped. Deadlines are mirrored to ``store``, so calendars
+    left open across a restart still expire.
+    """
+
+    KIND = "calendar"
+
+    def __init__(self, timeout: float, store: JobStore) -> None:
+        self.timeout = timeout
+        self.store = store
+        self._heap: List[Tuple[float, int]] = []
+        self._job = None
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def track(self, user_id: int, state, job_queue) -> None:
+        """(Re)start the timeout of the calendar open for ``user_id``."""
+        state.calendar_deadline = time.time() + self.timeout
+        heapq.heappush(self._heap, (state.calendar_deadline, user_id))
+        self.store.schedule(
+            self.KIND,
+            user_id,
+            state.calendar_deadline,
+            {"chat_id": state.data_chat_id, "message_id": state.data_message_id},
+        )
+        # Таймаут у всех календарей одинаковый: новый срок не раньше уже запланированного
+        if self._job is None:
+            self.arm(job_queue)
+
+    def expired(self, now: float) -> List[Tuple[int, float]]:
+        """Pop all entries due by ``now`` as ``(user_id, deadline)``."""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, user_id = heapq.heappop(self._heap)
+            self.store.cancel(self.KIND, user_id, deadline)
+            due.append((user_id, deadline))
+        return due
+
+    async def restore(self, job_queue) -> None:
+        """Re-arm calendars that were open when the bot stopped; overdue ones expire at once."""
+        restored = 0
+        for job in await self.store.load(self.KIND):
+            user_id, deadline = job["key"], job["run_at"]
+            state = user_states.peek(user_id)
+            if state is None:
+                # Состояние не сохранялось (STATE_BACKEND=memory) — хватит данных таймера
+                state = user_states.reset(
+                    user_id,
+                    data_chat_id=job["chat_id"],
+                    data_message_id=job["message_id"],
+                    waiting_for_date=messages.calendar_message,
+                )
+            elif not state.waiting_for_date:
+                self.store.cancel(self.KIND, user_id, deadline)
+                continue
+            state.calendar_deadline = deadline
+            heapq.heappush(self._heap, (deadline, user_id))
+            restored += 1
+        if restored:
+            logger.info("Восстановлено открытых календарей: %d", restored)
+        # Уже запущенный sweep (календарь открыли до готовности Mongo) сработает
+        # не позже чем через timeout и сам подхватит восстановленные сроки
+        if self._job is None:
+            self.arm(job_queue)
+
+    def arm(self, job_queue) -> None:
+        """Schedule the sweep job at the earliest deadline (if any)."""
+        self._job = None
+        if self._heap and job_queue is not None:
+            delay = max(self._heap[0][0] - time.time(), 0)
+            self._job = job_queue.run_once(sweep_calendars, when=delay, name="calendar_sweeper")
+
+
+calendar_sweeper = CalendarSweeper(CALENDAR_TIMEOUT_SECONDS, job_store)
+
+
+async def _expire_calendar(bot, chat_id, message_id):
+    """Удаляет просроченный календарь и сообщает об этом пользователю."""
+    try:
+        await bot.delete_message(chat_id=chat_id, message_id=message_id)
+    except Exception as exc:  # pragma: no cover - logging only
+        logger.warning("Ошибка удаления сообщения календаря: %s", exc)
+    try:
+        await bot.send_message(chat_id=chat_id, text=messages.calendar_timeout)
+    except Exception as exc:  # pragma: no cover - logging only
+        logger.warning("Ошибка отправки сообщения тайм-аута: %s", exc)
+
+
+async def sweep_calendars(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Удаляет пачкой календари, в которых пользователь не выбрал дату вовремя."""
+    expired = []
+    for user_id, deadline in calendar_sweeper.expired(time.time()):
+        state = user_states.peek(user_id)
+        if state is None or state.calendar_deadline != deadline or not state.waiting_for_date:
+            continue
+        expired.append((state.data_chat_id, state.data_message_id))
+        user_states.reset(user_id)
+    try:
+        await asyncio.gather(
+            *(_expire_calendar(context.bot, chat_id, message_id) for chat_id, message_id in expired)
+        )
+    finally:
+        calendar_sweeper.arm(context.job_queue)
 
 
 async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик нажатий на inline-кнопки."""
     try:
-        query = update.callback_query or update
-        bot = context.bot
-        user_id = query.from_user.id
-        bot_message_id = query.message.message_id
-        bot_message_text = query.message.text or query.message.caption or ""
-        if user_id not in user_states:
-            user_states[user_id] = {}
+        await callback_router.dispatch(update, context)
+    except Exception as exc:  # pragma: no cover - logging only
+        logger.error("Ошибка в button: %s", exc)
 
-        user_states[user_id]["data_chat_id"] = query.message.chat.id
-        user_states[user_id]["bot_message_caption"] = query.message.caption
 
-        if bot_message_text == messages.calendar_message or (
-            user_states[user_id].get("data_message_id") == bot_message_id
-        ):
-            await inline_handler(update, context)
-            return
+async def _open_task(query, bot) -> None:
+    """Переключает пользователя на задачу, на кнопку которой он нажал."""
+    user_id = query.from_user.id
+    state = user_states.get(user_id)
+    # Удаляем предыдущие служебные сообщения, если они существуют
+    if state.data_message_id is not None:
+        try:
+            await bot.delete_message(
+                chat_id=query.message.chat.id,
+                message_id=state.data_message_id,
+            )
+        except Exception as exc:  # pragma: no cover - logging only
+            logger.warning("Ошибка удаления сообщения: %s", exc)
+    user_states.reset(
+        user_id,
+        bot_message_id=query.message.message_id,
+        bot_message_text=query.message.text or query.message.caption or "",
+    )
 
-        # Удаляем предыдущие служебные сообщения, если они существуют
-        if "data_message_id" in user_states[user_id]:
-            try:
-                await bot.delete_message(
-                    chat_id=user_states[user_id]["data_chat_id"],
-                    message_id=user_states[user_id]["data_message_id"],
-                )
-            except Exception as exc:  # pragma: no cover - logging only
-                logger.warning("Ошибка удаления сообщения: %s", exc)
-        user_states[user_id] = {
-            "bot_message_id": bot_message_id,
-            "bot_message_text": bot_message_text,
-        }
 
-        source = (query.message.text or query.message.caption or "").replace("~~", "")
-        reply_markup = None
-        text = None
+async def _edit_task(query, bot, text, reply_markup) -> None:
+    if not text or text == query.message.text:
+        return
+    await edit_message(
+        bot,
+        query.message.chat.id,
+        query.message.message_id,
+        text,
+        reply_markup,
+        caption=not query.message.text,
+        shown=query.message,
+    )
 
-        if query.data == "date":
-            await calendar_handler(update, context)
-            return
-        if query.data == "del":
-            delete_reminders({"message_id": query.message.message_id})
-            try:
-                await bot.delete_message(
-                    chat_id=query.message.chat.id, message_id=query.message.message_id
-                )
-            except Exception as exc:  # pragma: no cover - logging only
-                logger.warning("Ошибка удаления сообщения 'del': %s", exc)
-            return
-        if query.data == "done":
-            text = f"✅ {source}" if source else "✅"
-            reply_markup = utils.task_markup(done=True)
-            delete_reminders({"message_id": query.message.message_id})
-        elif query.data == "undone":
-            if source.startswith("<del>") and source.endswith("</del>"):
-                source = source[5:-6]
-            text = (source[1:] if source.startswith("✅") else source) if source else None
-            reply_markup = utils.task_markup()
-        else:
-            # Игнорируем другие callback'и (например, календарь)
-            return
 
-        if text and text != query.message.text:
-            if query.message.text:
-                await bot.edit_message_text(
-                    chat_id=query.message.chat.id,
-                    message_id=query.message.message_id,
-                    text=text,
-                    reply_markup=reply_markup,
-                )
-            else:
-                await bot.edit_message_caption(
-                    chat_id=query.message.chat.id,
-                    message_id=query.message.message_id,
-                    caption=text,
-                    reply_markup=reply_markup,
-                )
+def _task_source(query) -> str:
+    return (query.message.text or query.message.caption or "").replace("~~", "")
+
+
+@callback_router.register("date")
+async def _on_date(update: Update, context: ContextTypes.DEFAULT_TYPE, action, payload) -> None:
+    await _open_task(update.callback_query, context.bot)
+    await calendar_handler(update, context)
+
+
+@callback_router.register("del")
+async def _on_delete(update: Update, context: ContextTypes.DEFAULT_TYPE, action, payload) -> None:
+    query = update.callback_query
+    await _open_task(query, context.bot)
+    write_buffer.delete({"chat_id": query.message.chat.id, "message_id": query.message.message_id})
+    try:
+        await context.bot.delete_message(
+            chat_id=query.message.chat.id, message_id=query.message.message_id
+        )
     except Exception as exc:  # pragma: no cover - logging only
-        logger.error("Ошибка в button: %s", exc)
+        logger.warning("Ошибка удаления сообщения 'del': %s", exc)
+
+
+@callback_router.register("done")
+async def _on_done(update: Update, context: ContextTypes.DEFAULT_TYPE, action, payload) -> None:
+    query = update.callback_query
+    await _open_task(query, context.bot)
+    source = _task_source(query)
+    write_buffer.delete({"chat_id": query.message.chat.id, "message_id": query.message.message_id})
+    await _edit_task(
+        query, context.bot, f"✅ {source}" if source else "✅", utils.task_markup(done=True)
+    )
+
+
+@callback_router.register("undone")
+async def _on_undone(update: Update, context: ContextTypes.DEFAULT_TYPE, action, payload) -> None:
+    query = update.callback_query
+    await _open_task(query, context.bot)
+    source = _task_source(query)
+    if source.startswith("<del>") and source.endswith("</del>"):
+        source = source[5:-6]
+    text = (source[1:] if source.startswith("✅") else source) if source else None
+    await _edit_task(query, context.bot, text, utils.task_markup())
 
 
 async def select_date(
@@ -144,40 +262,24 @@ async def select_date(
     bot_message_text = query.message.text or query.message.caption or ""
     logger.info("Дата выбрана")
     chat_id = query.message.chat.id
-    if count_reminders({"message_id": bot_message_id}) == 0:
-        today = " :" + datetime.datetime.today().strftime("%d-%m-%Y %H:%M")
-        insert_reminder(
-            {
-                "chat_id": chat_id,
-                "message_id": bot_message_id,
-                "message": bot_message_text,
-                "caption": user_states.get(query.from_user.id, {}).get(
-                    "bot_message_caption"
-                ),
-                "date": user_states.get(query.from_user.id, {})
-                .get("date", date)
-                .strftime("%d-%m-%Y %H:%M"),
-                "today": today,
-            }
-        )
-    else:
-        update_reminder(
-            bot_message_id,
-            {"date": user_states[query.from_user.id]["date"].strftime("%d-%m-%Y %H:%M")},
-        )
-    bot_message_text = user_states.get(query.from_user.id, {}).get(
-        "bot_message_text", ""
+    state = user_states.get(query.from_user.id)
+    today = " :" + datetime.datetime.today().strftime("%d-%m-%Y %H:%M")
+    await upsert_reminder(
+        chat_id,
+        bot_message_id,
+        due_fields(state.date if state.date is not None else date),
+        {
+            "message": bot_message_text,
+            "caption": state.bot_message_caption,
+            "today": today,
+        },
     )
+    bot_message_text = state.bot_message_text or ""
     text = (
         bot_message_text.split(" ::")[0] + " ::" + date.strftime("%d-%m-%Y %H:%M")
     ) if bot_message_text else ""
     if text and text != bot_message_text:
-        await context.bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=bot_message_id,
-            text=text,
-            reply_markup=utils.task_markup(),
-        )
+        await edit_message(context.bot, chat_id, bot_message_id, text, utils.task_markup())
 
 
 async def handle_datepicker_input(
@@ -199,13 +301,32 @@ async def handle_datepicker_input(
                     "Ошибка удаления сообщения handle_datepicker_input: %s", exc
                 )
             finally:
-                user_states[update.message.from_user.id] = {}
+                user_states.reset(update.message.from_user.id)
         else:
             await echo(update, context)
     except Exception as exc:  # pragma: no cover - logging only
         logger.error("Ошибка в handle_datepicker_input: %s", exc)
 
 
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /profile on|off|dump (только для ADMIN_IDS)."""
+    try:
+        if update.effective_user.id not in settings.ADMIN_IDS:
+            return
+        action = context.args[0] if context.args else "dump"
+        if action == "on":
+            profiler.enable()
+            text = "Профилирование включено"
+        elif action == "off":
+            path = profiler.disable()
+            text = f"Профилирование выключено, дамп: {path}" if path else "Профилирование не было включено"
+        else:
+            text = f"Дамп: {profiler.dump()}"
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=text)
+    except Exception as exc:  # pragma: no cover - logging only
+        logger.error("Ошибка в profile_command: %s", exc)
+
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /help."""
     logger.info("help_command вызван")
@@ -220,103 +341,110 @@ async def echo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
         bot = context.bot
         user_id = update.message.from_user.id
+        state = user_states.peek(user_id)
         if (
-            user_id in user_states
-            and "data_chat_id" in user_states[user_id]
-            and "data_message_id" in user_states[user_id]
+            state is not None
+            and state.data_chat_id is not None
+            and state.data_message_id is not None
         ):
             try:
                 await bot.delete_message(
-                    chat_id=user_states[user_id]["data_chat_id"],
-                    message_id=user_states[user_id]["data_message_id"],
+                    chat_id=state.data_chat_id,
+                    message_id=state.data_message_id,
                 )
             except Exception as exc:  # pragma: no cover - logging only
                 logger.warning("Ошибка удаления сообщения в echo: %s", exc)
             finally:
-                user_states[user_id] = {}
-        first = None
-        if update.message.video:
-            first = await update.message.reply_video(
-                video=update.message.video, caption=update.message.caption
-            )
-        elif update.message.audio:
-            first = await update.message.reply_audio(
-                audio=update.message.audio, caption=update.message.caption
-            )
-        elif update.message.document:
-            first = await update.message.reply_document(
-                document=update.message.document, caption=update.message.caption
-            )
-        elif update.message.sticker:
-            first = await update.message.reply_sticker(
-                sticker=update.message.sticker, caption=update.message.caption
-            )
-        elif update.message.voice:
-            first = await update.message.reply_voice(
-                voice=update.message.voice, caption=update.message.caption
-            )
-        elif update.message.location:
-            first = await update.message.reply_location(
-                location=update.message.location, caption=update.message.caption
-            )
-        elif update.message.contact:
-            first = await update.message.reply_contact(
-                contact=update.message.contact, caption=update.message.caption
-            )
-        elif update.message.venue:
-            first = await update.message.reply_venue(
-                venue=update.message.venue, caption=update.message.caption
-            )
-        else:
-            first = await update.message.reply_text(update.message.text)
+                user_states.reset(user_id)
+        message = update.message
+        media, captioned = _media_type(message)
         today = " ::" + datetime.datetime.today().strftime("%d-%m-%Y %H:%M")
-        if (
-            update.message.video
-            or update.message.audio
-            or update.message.document
-            or update.message.sticker
-            or update.message.voice
-            or update.message.location
-            or update.message.contact
-            or update.message.venue
-        ):
-            await bot.edit_message_caption(
-                chat_id=first.chat_id,
-                message_id=first.message_id,
-                caption=(first.caption or "") + today,
-                reply_markup=utils.task_markup(),
-            )
-        else:
-            await bot.edit_message_text(
-                chat_id=first.chat_id,
-                message_id=first.message_id,
-                text=(first.text or "") + today,
-                reply_markup=utils.task_markup(),
-            )
-        await update.message.delete()
+        with echo_latency.time(media or "text"):
+            if media is None:
+                await bot.send_message(
+                    chat_id=message.chat_id,
+                    text=(message.text or "") + today,
+                    reply_markup=utils.task_markup(),
+                )
+            else:
+                await _copy_task(bot, message, today if captioned else None)
+            await message.delete()
     except Exception as exc:  # pragma: no cover - logging only
         logger.error("Ошибка в echo: %s", exc)
 
 
+# Вложения в порядке проверки; True — при копировании можно задать подпись.
+# animation раньше document и venue раньше location: у них заполнены оба поля.
+ECHO_MEDIA = (
+    ("video", True),
+    ("animation", True),
+    ("audio", True),
+    ("document", True),
+    ("photo", True),
+    ("voice", True),
+    ("video_note", False),
+    ("sticker", False),
+    ("venue", False),
+    ("location", False),
+    ("contact", False),
+)
+
+
+def _media_type(message) -> Tuple[Optional[str], bool]:
+    """Return the attachment type of ``message`` (None for text) and whether it takes a caption."""
+    for media, captioned in ECHO_MEDIA:
+        if getattr(message, media):
+            return media, captioned
+    return None, False
+
+
+async def _copy_task(bot, message, today: Optional[str]) -> None:
+    """Копирует вложение в тот же чат с кнопками задачи — файл не загружается заново."""
+    caption = {}
+    if today is not None:
+        caption = {
+            "caption": (message.caption or "") + today,
+            "caption_entities": message.caption_entities,
+        }
+    try:
+        await bot.copy_message(
+            chat_id=message.chat_id,
+            from_chat_id=message.chat_id,
+            message_id=message.message_id,
+            reply_markup=utils.task_markup(),
+            **caption,
+        )
+    except BadRequest as exc:
+        if not caption:
+            raise
+        # Например, подпись с датой длиннее лимита — копируем с исходной подписью
+        logger.warning("Не удалось скопировать с новой подписью: %s", exc)
+        await bot.copy_message(
+            chat_id=message.chat_id,
+            from_chat_id=message.chat_id,
+            message_id=message.message_id,
+            reply_markup=utils.task_markup(),
+        )
+
+
 async def calendar_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик календаря."""
     try:
         query = update.callback_query or update
         bot = context.bot
         user_id = query.from_user.id
+        reply_markup = telegramcalendar.create_calendar()
         msg = await bot.send_message(
             chat_id=query.message.chat.id,
             text=messages.calendar_message,
-            reply_markup=telegramcalendar.create_calendar(),
-        )
-        user_states[user_id]["data_chat_id"] = msg.chat.id
-        user_states[user_id]["data_message_id"] = msg.message_id
-        user_states[user_id]["waiting_for_date"] = messages.calendar_message
-        if task := user_states[user_id].get("timeout_task"):
-            task.cancel()
-        user_states[user_id]["timeout_task"] = asyncio.create_task(
-            calendar_timeout(bot, msg.chat.id, msg.message_id, user_id)
+            reply_markup=reply_markup,
         )
+        render_cache.remember(msg.chat.id, msg.message_id, messages.calendar_message, reply_markup)
+        state = user_states.get(user_id)
+        state.data_chat_id = msg.chat.id
+        state.data_message_id = msg.message_id
+        state.waiting_for_date = messages.calendar_message
+        calendar_sweeper.track(user_id, state, context.job_queue)
     except Exception as exc:  # pragma: no cover - logging only
         logger.error("Ошибка в calendar_handler: %s", exc)
 
@@ -382,87 +510,79 @@ async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         logger.error("Ошибка в stop: %s", exc)
 
 
-async def inline_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Inline обработчики."""
+@callback_router.register(*telegramcalendar.ACTIONS)
+async def inline_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, action, date):
+    """Inline обработчики календаря."""
     try:
-        query = update.callback_query or update
-        utils.separate_callback_data(query.data)
-        await inline_calendar_handler(update, context)
+        query = update.callback_query
+        state = user_states.get(query.from_user.id)
+        state.data_chat_id = query.message.chat.id
+        state.bot_message_caption = query.message.caption
+        await inline_calendar_handler(update, context, (action, date))
     except Exception as exc:  # pragma: no cover - logging only
         logger.error("Ошибка в inline_handler: %s", exc)
 
 
-async def inline_calendar_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def inline_calendar_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, parsed=None):
     """Обработка нажатий календаря."""
     try:
         query = update.callback_query or update
         bot = context.bot
         user_id = query.from_user.id
-        selected, date = await telegramcalendar.process_calendar_selection(update, context)
-        if task := user_states.get(user_id, {}).pop("timeout_task", None):
-            task.cancel()
+        selected, date = await telegramcalendar.process_calendar_selection(update, context, parsed)
+        state = user_states.get(user_id)
         if selected:
-            user_states[user_id]["date"] = date
+            state.date = date
             try:
                 await context.bot.delete_message(
-                    chat_id=user_states[user_id]["data_chat_id"],
-                    message_id=user_states[user_id]["data_message_id"],
+                    chat_id=state.data_chat_id,
+                    message_id=state.data_message_id,
                 )
                 if date == "CANCEL":
-                    delete_reminders(
-                        {"message_id": user_states[user_id]["data_message_id"]}
+                    write_buffer.delete(
+                        {"chat_id": state.data_chat_id, "message_id": state.data_message_id}
                     )
                     try:
                         await bot.send_message(
-                            chat_id=user_states[user_id]["data_chat_id"],
+                            chat_id=state.data_chat_id,
                             text=messages.calendar_cancelled,
                         )
                     except Exception as exc:  # pragma: no cover - logging only
                         logger.warning("Ошибка отправки уведомления CANCEL: %s", exc)
-                    user_states[user_id] = {}
+                    user_states.reset(user_id)
                     return
                 text = (
-                    user_states[user_id]["bot_message_text"].split(" ::")[0]
+                    state.bot_message_text.split(" ::")[0]
                     + " ::"
                     + date.strftime("%d-%m-%Y %H:%M")
                 )
                 if text and text.strip() and text != messages.calendar_message:
-                    await context.bot.edit_message_text(
-                        chat_id=user_states[user_id]["data_chat_id"],
-                        message_id=user_states[user_id]["bot_message_id"],
-                        text=text,
-                        reply_markup=utils.task_markup(),
+                    await edit_message(
+                        context.bot,
+                        state.data_chat_id,
+                        state.bot_message_id,
+                        text,
+                        utils.task_markup(),
+                    )
+                    today = " :" + datetime.datetime.today().strftime(
+                        "%d-%m-%Y %H:%M"
+                    )
+                    await upsert_reminder(
+                        state.data_chat_id,
+                        state.bot_message_id,
+                        due_fields(date),
+                        {
+                            "message": state.bot_message_text.split(" ::")[0],
+                            "caption": state.bot_message_caption,
+                            "today": today,
+                        },
                     )
-                    if count_reminders(
-                        {"message_id": user_states[user_id]["bot_message_id"]}
-                    ) == 0:
-                        today = " :" + datetime.datetime.today().strftime(
-                            "%d-%m-%Y %H:%M"
-                        )
-                        insert_reminder(
-                            {
-                                "chat_id": user_states[user_id]["data_chat_id"],
-                                "message_id": user_states[user_id]["bot_message_id"],
-                                "message": user_states[user_id][
-                                    "bot_message_text"
-                                ].split(" ::")[0],
-                                "caption": user_states[user_id]["bot_message_caption"],
-                                "date": date.strftime("%d-%m-%Y %H:%M"),
-                                "today": today,
-                            }
-                        )
-                    else:
-                        update_reminder(
-                            user_states[user_id]["bot_message_id"],
-                            {"date": date.strftime("%d-%m-%Y %H:%M")},
-                        )
             except Exception as exc:  # pragma: no cover - logging only
                 logger.error("Ошибка в inline_calendar_handler: %s", exc)
             finally:
-                user_states[user_id] = {}
+                user_states.reset(user_id)
         else:
-            user_states[user_id]["timeout_task"] = asyncio.create_task(
-                calendar_timeout(bot, query.message.chat.id, query.message.message_id, user_id)
-            )
+            # Навигация по календарю только отодвигает срок
+            calendar_sweeper.track(user_id, state, context.job_queue)
     except Exception as exc:  # pragma: no cover - logging only
         logger.error("Ошибка в inline_calendar_handler (общая): %s", exc)
@@ -0,0 +1,90 @@
+"""Durable one-shot timers for the JobQueue, kept in Mongo to survive restarts."""
+
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from pymongo import DeleteOne, ReplaceOne
+
+import db
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class JobStore:
+    """Write-behind store of ``(kind, key) -> run_at`` timers with their payload.
+
+    PTB jobs cannot be persisted themselves (they hold the ``Application``), so
+    an owner keeps its schedule here and re-arms the JobQueue from :meth:`load`
+    on start. Changes of one timer are coalesced and all of them are written
+    with one ``bulk_write`` ``max_delay`` seconds after the first change.
+    ``run_at`` is ``time.time()`` seconds and only moves forward.
+    """
+
+    def __init__(self, max_delay: float) -> None:
+        self.max_delay = max_delay
+        # _id -> (run_at, операция); последняя операция по таймеру побеждает
+        self._pending: Dict[str, Tuple[float, object]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    @staticmethod
+    def _id(kind: str, key) -> str:
+        return f"{kind}:{key}"
+
+    def schedule(self, kind: str, key, run_at: float, data: dict) -> None:
+        """Persist the timer ``(kind, key)`` firing at ``run_at``, replacing the previous one."""
+        job_id = self._id(kind, key)
+        doc = {"_id": job_id, "kind": kind, "key": key, "run_at": run_at, **data}
+        self._pending[job_id] = (run_at, ReplaceOne({"_id": job_id}, doc, upsert=True))
+        self._schedule_flush()
+
+    def cancel(self, kind: str, key, run_at: float) -> None:
+        """Drop the timer fired (or abandoned) at ``run_at`` unless it was moved later since."""
+        job_id = self._id(kind, key)
+        pending = self._pending.get(job_id)
+        if pending is not None and pending[0] > run_at:
+            return
+        self._pending[job_id] = (run_at, DeleteOne({"_id": job_id, "run_at": {"$lte": run_at}}))
+        self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush_in_background)
+
+    def _flush_in_background(self) -> None:
+        task = asyncio.get_running_loop().create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self) -> None:
+        """Write all buffered timer changes, after a flush already in flight."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if not self._pending and not self._lock.locked():
+            return
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            ops = [op for _, op in self._pending.values()]
+            self._pending = {}
+            if not ops:
+                return
+            try:
+                await db.save_jobs(ops)
+            except Exception as exc:  # pragma: no cover - logging only
+                logger.error("Ошибка сохранения таймеров (%d операций): %s", len(ops), exc)
+
+    async def load(self, kind: str) -> List[dict]:
+        """Return the persisted timers of ``kind``, earliest first."""
+        await self.flush()
+        return await db.fetch_jobs(kind)
+
+
+job_store = JobStore(max_delay=settings.WRITE_BUFFER_MAX_DELAY_MS / 1000)
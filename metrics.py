@@ -0,0 +1,235 @@
+"""In-process metrics for hot paths, exported in the Prometheus text format."""
+
+import asyncio
+import bisect
+import contextlib
+import logging
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Опоздание напоминаний: от долей секунды до «пролежало сутки»
+DELAY_BUCKETS = (0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0, 86400.0)
+
+_registry: List["_Metric"] = []
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Метрики обновляются и из потоков пула Mongo
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _samples(self) -> Iterator[Tuple[str, Sequence[str], Sequence[str], float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, values, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonic count, one series per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield "", self.labelnames, labels, value
+
+
+class Gauge(_Metric):
+    """Current value; with ``func`` it is read at scrape time instead of set."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        func: Optional[Callable[[], float]] = None,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._func = func
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def set_function(self, func: Callable[[], float]) -> None:
+        self._func = func
+
+    def _samples(self):
+        if self._func is not None:
+            try:
+                yield "", (), (), self._func()
+            except Exception as exc:  # pragma: no cover - logging only
+                logger.warning("Ошибка чтения метрики %s: %s", self.name, exc)
+            return
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield "", self.labelnames, labels, value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        # labels -> [счётчики по бакетам (не накопленные), сумма, количество]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        """Measure the body of a ``with`` block, including failed runs."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def _samples(self):
+        with self._lock:
+            items = [(labels, (list(s[0]), s[1], s[2])) for labels, s in self._series.items()]
+        names = self.labelnames + ("le",)
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                yield "_bucket", names, labels + (_format_value(bound),), cumulative
+            yield "_sum", self.labelnames, labels, total
+            yield "_count", self.labelnames, labels, count
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+# Время обработки нажатий inline-кнопок, по действию
+callback_latency = Histogram("bot_callback_seconds", "Callback query handling time", ("action",))
+
+# Время echo (создание задачи из сообщения), по типу вложения
+echo_latency = Histogram("bot_echo_seconds", "Task creation (echo) time", ("media",))
+
+# Планировщик напоминаний
+tick_duration = Histogram("scheduler_tick_seconds", "pop_job tick duration")
+records_scanned = Counter("scheduler_records_scanned_total", "Due reminders found without a live lease")
+records_due = Counter("scheduler_records_due_total", "Due reminders claimed by this replica")
+trigger_delay = Histogram(
+    "scheduler_trigger_delay_seconds", "Delay between due_at and the reminder being sent",
+    buckets=DELAY_BUCKETS,
+)
+reminders_failed = Counter("scheduler_reminders_failed_total", "Reminders that failed to send")
+
+# Bot API
+api_latency = Histogram("telegram_api_seconds", "Bot API call latency", ("method",))
+api_errors = Counter("telegram_api_errors_total", "Failed Bot API calls", ("method", "error"))
+
+# Mongo
+mongo_latency = Histogram("mongo_op_seconds", "Mongo operation latency", ("op",))
+mongo_errors = Counter("mongo_op_errors_total", "Failed Mongo operations", ("op", "error"))
+
+# Правки сообщений: отправленные и пропущенные (содержимое не менялось)
+message_edits = Counter("bot_message_edits_total", "Message edits by result", ("result",))
+
+# Event loop
+loop_lag = Histogram("event_loop_lag_seconds", "How late the event loop wakes up a sleeping task")
+
+# Снимаются в момент запроса /metrics; функции задаёт app.py
+user_states_size = Gauge("bot_user_states", "Users with conversation state in memory")
+user_states_bytes = Gauge("bot_user_states_bytes", "Approximate memory held by user states")
+send_queue_depth = Gauge("send_queue_depth", "Bot API calls queued or in flight")
+update_queue_max = Gauge("bot_user_update_queue_max", "Longest per-user backlog of updates")
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records latency and errors of every Bot API method."""
+
+    async def post(self, url: str, *args, **kwargs):
+        method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            return await super().post(url, *args, **kwargs)
+        except Exception as exc:
+            api_errors.inc(method, type(exc).__name__)
+            raise
+        finally:
+            api_latency.observe(time.perf_counter() - started, method)
+
+
+async def watch_loop_lag(interval: float = 1.0) -> None:
+    """Sleep ``interval`` in a loop and record how late each wake-up is."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        loop_lag.observe(max(0.0, loop.time() - started - interval))
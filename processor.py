@@ -0,0 +1,79 @@
+"""Update processor: concurrent across users, strictly ordered per user."""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def _user_key(update: object) -> Optional[int]:
+    """Return the id whose updates must not overlap (user, else chat)."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Runs handlers of different users concurrently, one update at a time per user.
+
+    ``handlers.user_states`` is mutated without locks, so updates of the same
+    user are serialized in arrival order. ``max_concurrent_updates`` caps
+    handlers actually running; ``max_pending_updates`` caps updates accepted
+    from the queue, including those waiting behind an earlier update of the
+    same user (that wait does not take a running slot).
+    """
+
+    __slots__ = ("_running", "_locks", "_queued", "_max_running")
+
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: int) -> None:
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self._max_running = max_concurrent_updates
+        self._running: Optional[asyncio.Semaphore] = None
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._queued: Dict[int, int] = {}
+
+    @property
+    def queue_lengths(self) -> Dict[int, int]:
+        """Updates accepted but not finished, per user (only users with any)."""
+        return dict(self._queued)
+
+    @property
+    def max_queue_length(self) -> int:
+        """Longest per-user backlog right now."""
+        return max(self._queued.values(), default=0)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = _user_key(update)
+        if key is None:
+            async with self._running:
+                await coroutine
+            return
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._queued[key] = self._queued.get(key, 0) + 1
+        try:
+            async with lock, self._running:
+                await coroutine
+        finally:
+            self._queued[key] -= 1
+            if not self._queued[key]:
+                # Пользователь без очереди — лок больше не нужен, словари не растут
+                del self._queued[key]
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        self._running = asyncio.Semaphore(self._max_running)
+
+    async def shutdown(self) -> None:
+        if self._queued:
+            logger.info("Остановка обработки: в очередях пользователей %d обновлений",
+                        sum(self._queued.values()))
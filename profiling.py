@@ -0,0 +1,211 @@
+"""Runtime profiling: event-loop block detection, stack sampling and timing spans.
+
+Off by default and nearly free while off. When enabled, a watchdog thread
+watches a heartbeat scheduled on the event loop: if the loop does not run it
+for longer than the threshold, the loop thread's stack is captured — that is
+the code blocking it. The same thread samples the loop thread's stack at a
+fixed interval (folded stacks, ready for flamegraph.pl / speedscope), and
+``span``/``traced`` record the duration of handlers and db calls. Everything
+collected goes to a JSON dump file.
+"""
+
+import asyncio
+import collections
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, TypeVar
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Сколько блокировок и разных стеков хранить в дампе
+MAX_BLOCKS = 200
+MAX_STACKS = 500
+
+
+def _folded(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    """Collects loop blocks, stack samples and spans between ``enable`` and ``disable``."""
+
+    def __init__(self, block_threshold: float, sample_interval: float, dump_path: str) -> None:
+        self.block_threshold = block_threshold
+        self.sample_interval = sample_interval
+        self.dump_path = dump_path
+        self.enabled = False
+        # Пульс ставится в event loop чаще, чем порог блокировки
+        self._heartbeat_interval = min(block_threshold / 2, 0.05)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._heartbeat_handle: Optional[asyncio.TimerHandle] = None
+        self._beat = 0.0
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._started = time.time()
+        self._spans: Dict[str, List[float]] = {}
+        self._blocks: collections.deque = collections.deque(maxlen=MAX_BLOCKS)
+        self._samples: collections.Counter = collections.Counter()
+
+    def enable(self) -> None:
+        """Start profiling; must be called from the event loop thread."""
+        if self.enabled:
+            return
+        self._reset()
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._heartbeat()
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="profiler", daemon=True)
+        self._watchdog.start()
+        self.enabled = True
+        logger.warning(
+            "Профилирование включено: блокировки > %.0f мс, сэмплы раз в %.0f мс",
+            self.block_threshold * 1000, self.sample_interval * 1000,
+        )
+
+    def disable(self) -> Optional[str]:
+        """Stop profiling and write the dump; return its path."""
+        if not self.enabled:
+            return None
+        self.enabled = False
+        self._stop.set()
+        if self._heartbeat_handle is not None:
+            self._heartbeat_handle.cancel()
+        self._watchdog.join()
+        path = self.dump()
+        logger.warning("Профилирование выключено, дамп: %s", path)
+        return path
+
+    def toggle(self) -> None:
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def _heartbeat(self) -> None:
+        self._beat = time.monotonic()
+        self._heartbeat_handle = self._loop.call_later(self._heartbeat_interval, self._heartbeat)
+
+    def _watch(self) -> None:
+        """Watchdog thread: detect loop blocks and sample the loop thread's stack."""
+        tick = self._heartbeat_interval / 2
+        if self.sample_interval > 0:
+            tick = min(tick, self.sample_interval)
+        next_sample = time.monotonic()
+        blocked_since: Optional[float] = None
+        block: Optional[dict] = None
+        while not self._stop.wait(tick):
+            now = time.monotonic()
+            beat = self._beat
+            frame = sys._current_frames().get(self._loop_thread)
+            if now - beat - self._heartbeat_interval > self.block_threshold:
+                if blocked_since != beat and frame is not None:
+                    # Loop стоит прямо сейчас — его стек и есть виновник
+                    blocked_since = beat
+                    block = {
+                        "at": time.time(),
+                        "duration_ms": None,
+                        "stack": traceback.format_stack(frame),
+                    }
+                    with self._lock:
+                        self._blocks.append(block)
+                if block is not None:
+                    block["duration_ms"] = round((now - beat - self._heartbeat_interval) * 1000, 1)
+            else:
+                block = None
+            if self.sample_interval > 0 and now >= next_sample and frame is not None:
+                next_sample = now + self.sample_interval
+                stack = _folded(frame)
+                with self._lock:
+                    if stack in self._samples or len(self._samples) < MAX_STACKS:
+                        self._samples[stack] += 1
+            del frame
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            span = self._spans.get(name)
+            if span is None:
+                span = self._spans[name] = [0, 0.0, 0.0]
+            span[0] += 1
+            span[1] += seconds
+            span[2] = max(span[2], seconds)
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Time the body of a ``with`` block while profiling is on."""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def traced(self, func: Callable[..., Awaitable[T]], name: Optional[str] = None) -> Callable[..., Awaitable[T]]:
+        """Wrap a coroutine function in a span named after it."""
+        name = name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return await func(*args, **kwargs)
+            with self.span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    def dump(self) -> str:
+        """Write what was collected so far to ``dump_path`` (atomically)."""
+        with self._lock:
+            spans = {
+                name: {
+                    "count": count,
+                    "total_ms": round(total * 1000, 3),
+                    "mean_ms": round(total / count * 1000, 3),
+                    "max_ms": round(worst * 1000, 3),
+                }
+                for name, (count, total, worst) in sorted(self._spans.items(), key=lambda kv: -kv[1][1])
+            }
+            report = {
+                "started": self._started,
+                "duration_s": round(time.time() - self._started, 3),
+                "block_threshold_ms": self.block_threshold * 1000,
+                "spans": spans,
+                "blocks": list(self._blocks),
+                "total_samples": sum(self._samples.values()),
+                "samples": dict(self._samples.most_common()),
+            }
+        tmp_path = self.dump_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.dump_path)
+        return self.dump_path
+
+
+profiler = Profiler(
+    block_threshold=settings.PROFILING_BLOCK_MS / 1000,
+    sample_interval=settings.PROFILING_SAMPLE_MS / 1000,
+    dump_path=settings.PROFILING_DUMP_PATH,
+)
@@ -0,0 +1,95 @@
+"""Last rendered content of bot messages, to skip edits that change nothing."""
+
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from telegram import InlineKeyboardMarkup, Message
+from telegram.error import BadRequest
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Сколько сообщений помним; старые вытесняются (LRU)
+RENDER_CACHE_SIZE = 10000
+
+
+class RenderCache:
+    """Bounded map ``(chat_id, message_id) -> hash(text, markup)``."""
+
+    def __init__(self, max_messages: int) -> None:
+        self.max_messages = max_messages
+        self._rendered: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._rendered)
+
+    @staticmethod
+    def _digest(text: Optional[str], markup: Optional[InlineKeyboardMarkup]) -> int:
+        # Разметка PTB неизменяема и хэшируется по содержимому кнопок
+        return hash((text, markup))
+
+    def remember(self, chat_id: int, message_id: int, text, markup) -> None:
+        key = (chat_id, message_id)
+        self._rendered[key] = self._digest(text, markup)
+        self._rendered.move_to_end(key)
+        while len(self._rendered) > self.max_messages:
+            self._rendered.popitem(last=False)
+
+    def unchanged(self, chat_id: int, message_id: int, text, markup, shown: Optional[Message] = None) -> bool:
+        """Whether the message already shows ``text`` and ``markup``.
+
+        Without a cached entry, ``shown`` (the message as delivered with the
+        callback query) is used to seed the cache.
+        """
+        digest = self._rendered.get((chat_id, message_id))
+        if digest is None:
+            if shown is None:
+                return False
+            self.remember(chat_id, message_id, shown.text or shown.caption, shown.reply_markup)
+            digest = self._rendered[(chat_id, message_id)]
+        return digest == self._digest(text, markup)
+
+
+render_cache = RenderCache(RENDER_CACHE_SIZE)
+
+
+def _not_modified(exc: BadRequest) -> bool:
+    return "message is not modified" in exc.message.lower()
+
+
+async def edit_message(
+    bot,
+    chat_id: int,
+    message_id: int,
+    text: str,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+    *,
+    caption: bool = False,
+    shown: Optional[Message] = None,
+) -> bool:
+    """Edit the text (or caption) and markup unless they are already shown.
+
+    Returns ``False`` when no edit was needed. "Message is not modified"
+    from Telegram counts as success rather than an error.
+    """
+    if render_cache.unchanged(chat_id, message_id, text, reply_markup, shown):
+        metrics.message_edits.inc("skipped")
+        return False
+    metrics.message_edits.inc("sent")
+    try:
+        if caption:
+            await bot.edit_message_caption(
+                chat_id=chat_id, message_id=message_id, caption=text, reply_markup=reply_markup
+            )
+        else:
+            await bot.edit_message_text(
+                chat_id=chat_id, message_id=message_id, text=text, reply_markup=reply_markup
+            )
+    except BadRequest as exc:
+        if not _not_modified(exc):
+            raise
+        logger.debug("Сообщение %s уже актуально", message_id)
+    render_cache.remember(chat_id, message_id, text, reply_markup)
+    return True
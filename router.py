@@ -0,0 +1,62 @@
+"""Table-driven dispatch of callback queries."""
+
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# handler(update, context, action, payload)
+CallbackHandler = Callable[[Update, ContextTypes.DEFAULT_TYPE, str, Any], Awaitable[Any]]
+# parser(data) -> (action, payload)
+CallbackParser = Callable[[str], Tuple[str, Any]]
+
+
+class CallbackRouter:
+    """Parses ``callback_data`` once and dispatches it by action.
+
+    Data starting with a registered prefix is decoded by that prefix's parser
+    into ``(action, payload)``; any other data is the action itself. Handlers
+    are looked up in a dict, and each dispatch is timed per action.
+    """
+
+    def __init__(self, latency: Histogram) -> None:
+        self.latency = latency
+        self._routes: Dict[str, CallbackHandler] = {}
+        self._parsers: List[Tuple[str, CallbackParser]] = []
+
+    def add_parser(self, prefix: str, parser: CallbackParser) -> None:
+        """Decode data starting with ``prefix`` with ``parser``."""
+        self._parsers.append((prefix, parser))
+
+    def register(self, *actions: str) -> Callable[[CallbackHandler], CallbackHandler]:
+        """Decorator routing ``actions`` to the decorated handler."""
+
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            for action in actions:
+                if action in self._routes:
+                    raise ValueError(f"Callback action {action!r} is already registered")
+                self._routes[action] = handler
+            return handler
+
+        return decorator
+
+    def parse(self, data: str) -> Tuple[str, Any]:
+        for prefix, parser in self._parsers:
+            if data.startswith(prefix):
+                return parser(data)
+        return data, None
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> Optional[Any]:
+        """Run the handler for ``update.callback_query``; unknown actions are ignored."""
+        action, payload = self.parse(update.callback_query.data or "")
+        handler = self._routes.get(action)
+        if handler is None:
+            logger.debug("Нет обработчика для callback %r", action)
+            return None
+        with self.latency.time(action):
+            return await handler(update, context, action, payload)
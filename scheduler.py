@@ -1,94 +1,278 @@
+import asyncio
 import datetime
+import heapq
 import logging
-from typing import Optional
+import os
+import socket
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
 
 from dateutil.relativedelta import relativedelta
-from telegram.ext import ContextTypes
+from telegram.ext import Application, ContextTypes, Job
 
-from db import delete_reminders, fetch_reminders, update_reminder
+import db
+import metrics
+from config import settings
+from db import claim_due_reminders, due_fields, fetch_schedule, release_fields, write_buffer
+from sendqueue import send_queue
 import utils
 
 logger = logging.getLogger(__name__)
 
-# Сколько секунд считаем «попаданием» во время
-TRIGGER_WINDOW_SECONDS = 59
+# Насколько вперёд держим расписание в памяти; дальше — догружаем при пробуждении
+SCHEDULE_HORIZON = datetime.timedelta(hours=6)
+# Сколько ближайших сроков читаем за одну загрузку (старт после рестарта не сканирует всё окно)
+SCHEDULE_BATCH = 1000
+# Опоздавшие (например, после рестарта) напоминания ещё отправляем, пока их не удалил TTL
+CATCH_UP = db.REMINDER_TTL
+# Идентификатор реплики — владелец лизов на напоминания
+WORKER_ID = settings.WORKER_ID or f"{socket.gethostname()}:{os.getpid()}"
+# Bot API принимает до 100 сообщений в одном deleteMessages
+DELETE_BATCH_SIZE = 100
+# Через сколько повторить тик, упавший на полпути (например, по таймауту Mongo):
+# наступившие сроки он уже снял с кучи, и иначе они ждали бы следующего пробуждения
+TICK_RETRY = datetime.timedelta(seconds=5)
 
 
-def _is_due(date_obj: datetime.datetime, now: datetime.datetime) -> bool:
-    """Напоминание «пора» — если now в пределах [date, date+window]."""
-    if now < date_obj:
-        return False
-    return (now - date_obj).total_seconds() <= TRIGGER_WINDOW_SECONDS
+class ReminderQueue:
+    """Min-heap of upcoming due times that wakes ``pop_job`` exactly when needed.
+
+    The heap only decides *when* to wake up: what actually fires is always
+    taken from Mongo by the indexed ``due_at`` query, so a stale heap entry
+    costs at most one idle wake-up.
+    """
+
+    def __init__(self) -> None:
+        # Ключ — (chat_id, message_id): message_id уникален только внутри чата
+        self._heap: List[Tuple[datetime.datetime, Tuple[int, int]]] = []
+        self._due: Dict[Tuple[int, int], datetime.datetime] = {}
+        self._loaded_until: Optional[datetime.datetime] = None
+        self._app: Optional[Application] = None
+        self._job: Optional[Job] = None
+        self._armed_at: Optional[datetime.datetime] = None
+        self._running = False
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def push(self, chat_id: int, message_id: int, due_at: Optional[datetime.datetime]) -> None:
+        """Track a new due time for ``message_id`` in ``chat_id`` (``None`` forgets it)."""
+        key = (chat_id, message_id)
+        if due_at is None:
+            self._due.pop(key, None)
+            return
+        if self._loaded_until is not None and due_at > self._loaded_until:
+            # За горизонтом — подхватим при следующей загрузке
+            self._due.pop(key, None)
+            return
+        self._due[key] = due_at
+        heapq.heappush(self._heap, (due_at, key))
+        if self._armed_at is None or due_at < self._armed_at:
+            self._arm()
+
+    def next_due(self) -> Optional[datetime.datetime]:
+        """Return the earliest live due time, dropping stale heap entries."""
+        while self._heap:
+            due_at, key = self._heap[0]
+            if self._due.get(key) == due_at:
+                return due_at
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now: datetime.datetime) -> int:
+        """Drop all entries due at or before ``now``; return how many were live."""
+        popped = 0
+        while self._heap and self._heap[0][0] <= now:
+            due_at, key = heapq.heappop(self._heap)
+            if self._due.get(key) == due_at:
+                del self._due[key]
+                popped += 1
+        return popped
+
+    async def load(self, now: datetime.datetime) -> None:
+        """(Re)load the schedule for ``[now - CATCH_UP, now + SCHEDULE_HORIZON]`` from Mongo.
+
+        At most ``SCHEDULE_BATCH`` earliest entries are read; if the window holds
+        more, it is cut at the last loaded due time and the rest is read on the
+        wake-up there. Records due at the cut itself are claimed from Mongo then.
+        """
+        until = now + SCHEDULE_HORIZON
+        entries = await fetch_schedule(now - CATCH_UP, until, SCHEDULE_BATCH)
+        if len(entries) >= SCHEDULE_BATCH:
+            until = entries[-1][1]
+        self._due = dict(entries)
+        self._heap = [(due_at, key) for key, due_at in self._due.items()]
+        heapq.heapify(self._heap)
+        self._loaded_until = until
+        logger.info("Расписание загружено: %d напоминаний до %s", len(self._due), until)
+
+    async def begin_tick(self, now: datetime.datetime) -> None:
+        """Mark a ``pop_job`` run as in progress and consume the due entries."""
+        self._running = True
+        self._job = None
+        self._armed_at = None
+        if self._loaded_until is None or now >= self._loaded_until:
+            await self.load(now)
+        self.pop_due(now)
+
+    def end_tick(self, backlog: bool = False, failed: bool = False) -> None:
+        """Finish a ``pop_job`` run and arm the next wake-up.
+
+        ``backlog`` means the claim batch was full and the next run is needed
+        right away; ``failed`` retries the run after ``TICK_RETRY``.
+        """
+        self._running = False
+        now = datetime.datetime.now()
+        if backlog:
+            self._arm(now)
+        else:
+            self._arm(now + TICK_RETRY if failed else None)
+
+    async def start(self, app: Application) -> None:
+        """Load the schedule and start listening to db changes; safe to retry."""
+        if self._app is None:
+            db.subscribe(self.push)
+        self._app = app
+        await self.load(datetime.datetime.now())
+        self._arm()
+
+    def _arm(self, asap: Optional[datetime.datetime] = None) -> None:
+        """Schedule a single ``pop_job`` run at the next wake-up time."""
+        if self._app is None or self._running:
+            return
+        candidates = [t for t in (self.next_due(), self._loaded_until, asap) if t is not None]
+        if settings.SCHEDULER_SWEEP_SECONDS > 0:
+            # Несколько реплик: подбираем напоминания, созданные другими подами,
+            # и те, чьи лизы истекли вместе с упавшим подом
+            candidates.append(
+                datetime.datetime.now() + datetime.timedelta(seconds=settings.SCHEDULER_SWEEP_SECONDS)
+            )
+        wake_at = min(candidates, default=None)
+        if wake_at is None or wake_at == self._armed_at:
+            return
+        if self._job is not None:
+            self._job.schedule_removal()
+        delay = max((wake_at - datetime.datetime.now()).total_seconds(), 0)
+        # Передаём задержку, а не datetime: JobQueue трактует naive-время как UTC
+        self._job = self._app.job_queue.run_once(pop_job, when=delay, name="pop_job")
+        self._armed_at = wake_at
+        logger.debug("pop_job запланирован на %s (через %.1fs)", wake_at, delay)
+
+
+reminder_queue = ReminderQueue()
 
 
 async def _trigger_reminder(context: ContextTypes.DEFAULT_TYPE, rec: dict, now: datetime.datetime) -> Optional[int]:
     """
-    Триггерим напоминание: копируем исходное сообщение, вешаем клавиатуру,
-    удаляем старое, переносим дату на +10 минут. Возвращаем новый message_id.
+    Триггерим напоминание: копируем исходное сообщение сразу с клавиатурой
+    задачи. Старое сообщение удаляется и дата переносится уже пачкой в pop_job.
+    Возвращаем новый message_id.
     """
     bot = context.application.bot
     try:
-        new_msg = await bot.copy_message(
-            chat_id=rec["chat_id"],
-            from_chat_id=rec["chat_id"],
+        chat_id = rec["chat_id"]
+        new_msg = await send_queue.call(
+            chat_id,
+            bot.copy_message,
+            chat_id=chat_id,
+            from_chat_id=chat_id,
             message_id=rec["message_id"],
-        )
-        await bot.edit_message_reply_markup(
-            chat_id=rec["chat_id"],
-            message_id=new_msg.message_id,
             reply_markup=utils.task_markup(),
         )
-        try:
-            await bot.delete_message(chat_id=rec["chat_id"], message_id=rec["message_id"])
-        except Exception as exc:
-            logger.warning("Не удалось удалить старое сообщение %s: %s", rec["message_id"], exc)
-
-        # Переносим дату на +10 минут — чтобы не дёргать пользователя чаще, чем нужно
-        update_reminder(
-            rec["message_id"],
-            {
-                "message_id": new_msg.message_id,
-                "date": (now + relativedelta(minutes=10)).strftime("%d-%m-%Y %H:%M"),
-            },
-        )
         return new_msg.message_id
     except Exception as exc:
         logger.error("Ошибка триггера напоминания для msg_id=%s: %s", rec.get("message_id"), exc)
         return None
 
 
+async def _delete_old_messages(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_ids: List[int]) -> None:
+    """Удаляет старые сообщения чата пачками через deleteMessages."""
+    bot = context.application.bot
+    for i in range(0, len(message_ids), DELETE_BATCH_SIZE):
+        batch = message_ids[i:i + DELETE_BATCH_SIZE]
+        try:
+            await send_queue.call(chat_id, bot.delete_messages, chat_id=chat_id, message_ids=batch)
+        except Exception as exc:
+            logger.warning("Не удалось удалить старые сообщения %s: %s", batch, exc)
+
+
+async def _fire(context: ContextTypes.DEFAULT_TYPE, rec: dict, now: datetime.datetime) -> Optional[int]:
+    """Отправляет одно захваченное напоминание; при неудаче откладывает на минуту."""
+    msg_id = rec.get("message_id")
+    chat_id = rec.get("chat_id")
+    if not msg_id or not chat_id:
+        logger.warning("Пропускаю битую запись: %r", rec)
+        return None
+
+    logger.info("TRIGGER: chat_id=%s msg_id=%s date=%s now=%s",
+                chat_id, msg_id, rec["due_at"], now)
+    new_id = await _trigger_reminder(context, rec, now)
+    if new_id is None:
+        metrics.reminders_failed.inc()
+        # Если не получилось — чтобы не зависнуть навечно, отложим ещё на минуту
+        write_buffer.update(chat_id, msg_id, {**due_fields(now + relativedelta(minutes=1)), **release_fields()})
+    else:
+        metrics.trigger_delay.observe((datetime.datetime.now() - rec["due_at"]).total_seconds())
+    return new_id
+
+
 async def pop_job(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Периодически проверяет расписание и триггерит напоминания."""
+    """Триггерит наступившие напоминания и планирует следующее пробуждение."""
     now = datetime.datetime.now()
+    records = []
+    failed = False
     try:
-        records = fetch_reminders()
-        logger.debug("pop_job: всего записей=%d, now=%s", len(records), now.strftime("%d-%m-%Y %H:%M:%S"))
-        for rec in records:
-            date_str = rec.get("date")
-            msg_id = rec.get("message_id")
-            chat_id = rec.get("chat_id")
-
-            if not date_str or not msg_id or not chat_id:
-                logger.warning("Пропускаю битую запись: %r", rec)
-                continue
-
-            try:
-                date_obj = datetime.datetime.strptime(date_str, "%d-%m-%Y %H:%M")
-            except Exception as exc:
-                logger.warning("Некорректная дата '%s' у записи %r: %s", date_str, rec, exc)
-                continue
-
-            if _is_due(date_obj, now):
-                logger.info("TRIGGER: chat_id=%s msg_id=%s date=%s now=%s",
-                            chat_id, msg_id, date_obj, now)
-                new_id = await _trigger_reminder(context, rec, now)
-                if new_id is None:
-                    # Если не получилось — чтобы не зависнуть навечно, отложим ещё на минуту
-                    update_reminder(msg_id, {"date": (now + relativedelta(minutes=1)).strftime("%d-%m-%Y %H:%M")})
-            elif date_obj < (now - relativedelta(days=1)):
-                # Санитарная очистка: если запись старше суток — удаляем
-                logger.info("CLEANUP: удаляю просроченное напоминание chat_id=%s msg_id=%s date=%s",
-                            chat_id, msg_id, date_obj)
-                delete_reminders({"message_id": msg_id})
-    except Exception as exc:
-        logger.error("Ошибка в pop_job: %s", exc)
+        await reminder_queue.begin_tick(now)
+
+        # Mongo по индексу due_at отдаёт всё наступившее за последние сутки —
+        # опоздавшие напоминания тоже отправятся, а не пропадут. Каждое
+        # напоминание захватывается лизом, поэтому реплики не дублируют отправку
+        records = await claim_due_reminders(
+            now - CATCH_UP,
+            now,
+            f"{WORKER_ID}:{uuid.uuid4().hex[:8]}",
+            now + datetime.timedelta(seconds=settings.REMINDER_LEASE_SECONDS),
+            settings.REMINDER_CLAIM_BATCH,
+        )
+        logger.debug("pop_job: захвачено=%d, now=%s", len(records), now.strftime("%d-%m-%Y %H:%M:%S"))
+        calls_before = send_queue.total_calls
+        # Все напоминания тика уходят параллельно; темп задаёт очередь отправки
+        new_ids = await asyncio.gather(*(_fire(context, rec, now) for rec in records))
+        fired = [(rec, new_id) for rec, new_id in zip(records, new_ids) if new_id is not None]
+
+        # Перенос даты на +10 минут (чтобы не дёргать пользователя чаще) копится
+        # в буфере записи, а старые сообщения удаляем одним запросом на чат
+        old_by_chat: Dict[int, List[int]] = defaultdict(list)
+        for rec, new_id in fired:
+            old_by_chat[rec["chat_id"]].append(rec["message_id"])
+            write_buffer.update(
+                rec["chat_id"],
+                rec["message_id"],
+                {
+                    "message_id": new_id,
+                    **due_fields(now + relativedelta(minutes=10)),
+                    **release_fields(),
+                },
+            )
+        await asyncio.gather(
+            *(_delete_old_messages(context, chat_id, ids) for chat_id, ids in old_by_chat.items())
+        )
+        if records:
+            calls = send_queue.total_calls - calls_before
+            logger.info(
+                "pop_job: напоминаний=%d, вызовов API=%d (%.2f на напоминание) за %.1fs",
+                len(records), calls, calls / len(records),
+                (datetime.datetime.now() - now).total_seconds(),
+            )
+
+        # Всё, что тик изменил, уходит в Mongo одним bulk_write; просроченные
+        # записи удаляет TTL-индекс по expires_at
+        await write_buffer.flush()
+    except Exception:
+        failed = True
+        # У TimeoutError пустое сообщение — пишем трейсбек целиком
+        logger.exception("Ошибка в pop_job, повтор через %s", TICK_RETRY)
+    finally:
+        metrics.tick_duration.observe((datetime.datetime.now() - now).total_seconds())
+        reminder_queue.end_tick(backlog=len(records) >= settings.REMINDER_CLAIM_BATCH, failed=failed)
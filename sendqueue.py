@@ -0,0 +1,135 @@
+"""Rate-limited outbound queue for Bot API calls made by the scheduler."""
+
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from telegram.error import RetryAfter
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Сколько бакетов чатов держим, прежде чем выбросить давно неиспользуемые
+MAX_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second, up to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Take a token if available; otherwise return seconds to wait for one."""
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self) -> None:
+        while (wait := self.delay()) > 0:
+            await asyncio.sleep(wait)
+
+
+class SendQueue:
+    """Dispatches Bot API calls under a global and a per-chat token bucket.
+
+    Up to ``concurrency`` calls run at once; ``RetryAfter`` from Telegram pauses
+    the whole queue for the requested time before the call is retried.
+    """
+
+    def __init__(
+        self,
+        global_rate: float,
+        per_chat_rate: float,
+        per_chat_burst: float,
+        concurrency: int,
+        max_retries: int,
+    ) -> None:
+        self._global = TokenBucket(global_rate, global_rate)
+        self._per_chat_rate = per_chat_rate
+        self._per_chat_burst = per_chat_burst
+        self._chats: Dict[int, TokenBucket] = {}
+        self._concurrency = concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._max_retries = max_retries
+        self._paused_until = 0.0
+        self._pending = 0
+        # Сколько вызовов Bot API сделано, по имени метода (с учётом повторов)
+        self.calls: Counter = Counter()
+
+    @property
+    def depth(self) -> int:
+        """Number of calls queued or in flight."""
+        return self._pending
+
+    @property
+    def total_calls(self) -> int:
+        """Number of Bot API calls issued so far."""
+        return sum(self.calls.values())
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                self._prune()
+            bucket = self._chats[chat_id] = TokenBucket(self._per_chat_rate, self._per_chat_burst)
+        return bucket
+
+    def _prune(self) -> None:
+        """Drop buckets that have refilled completely — they carry no state."""
+        now = time.monotonic()
+        idle = self._per_chat_burst / self._per_chat_rate
+        self._chats = {
+            chat_id: bucket for chat_id, bucket in self._chats.items() if now - bucket.updated < idle
+        }
+
+    async def call(self, chat_id: int, method: Callable[..., Awaitable[T]], /, *args, **kwargs) -> T:
+        """Run ``method(*args, **kwargs)`` once the rate limits for ``chat_id`` allow it."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        self._pending += 1
+        try:
+            attempt = 0
+            while True:
+                await self._chat_bucket(chat_id).acquire()
+                async with self._semaphore:
+                    if (pause := self._paused_until - time.monotonic()) > 0:
+                        await asyncio.sleep(pause)
+                    await self._global.acquire()
+                    self.calls[getattr(method, "__name__", repr(method))] += 1
+                    try:
+                        return await method(*args, **kwargs)
+                    except RetryAfter as exc:
+                        attempt += 1
+                        if attempt > self._max_retries:
+                            raise
+                        self._paused_until = max(self._paused_until, time.monotonic() + exc.retry_after)
+                        logger.warning(
+                            "Flood control: пауза %ss (chat_id=%s, попытка %d)",
+                            exc.retry_after, chat_id, attempt,
+                        )
+        finally:
+            self._pending -= 1
+
+
+send_queue = SendQueue(
+    global_rate=settings.SEND_RATE_GLOBAL,
+    per_chat_rate=settings.SEND_RATE_PER_CHAT,
+    per_chat_burst=settings.SEND_BURST_PER_CHAT,
+    concurrency=settings.SEND_CONCURRENCY,
+    max_retries=settings.SEND_MAX_RETRIES,
+)
@@ -0,0 +1,172 @@
+"""Per-user conversation state with LRU/TTL eviction and optional persistence."""
+
+import logging
+import sys
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set
+
+import db
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class UserState:
+    """What the bot remembers about one user between button presses."""
+
+    __slots__ = (
+        "bot_message_id",       # сообщение-задача, с которым работает пользователь
+        "bot_message_text",
+        "bot_message_caption",
+        "data_chat_id",         # служебное сообщение (календарь)
+        "data_message_id",
+        "waiting_for_date",
+        "date",                 # выбранная дата или "CANCEL"
+        "calendar_deadline",    # time.time(), когда открытый календарь истекает
+        "touched",              # time.monotonic() последнего обращения
+    )
+
+    # Поля, которые переживают рестарт (calendar_deadline хранит jobstore, touched — только в памяти)
+    PERSISTED = __slots__[:7]
+
+    def __init__(self, **fields) -> None:
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+        self.touched = time.monotonic()
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.PERSISTED if getattr(self, name) is not None}
+
+    def is_empty(self) -> bool:
+        return not self.to_dict() and self.calendar_deadline is None
+
+    def size(self) -> int:
+        """Approximate memory footprint in bytes."""
+        return sys.getsizeof(self) + sum(sys.getsizeof(getattr(self, name)) for name in self.PERSISTED)
+
+
+class StateBackend:
+    """Persistence for :class:`StateStore`; the default keeps nothing."""
+
+    async def load_all(self) -> Dict[int, dict]:
+        return {}
+
+    async def save(self, states: Dict[int, dict], deleted: Iterable[int]) -> None:
+        pass
+
+
+class MongoStateBackend(StateBackend):
+    """Keeps states in a Mongo collection so they survive restarts.
+
+    States are read once, on start, and written back whole: replicas do not
+    see each other's changes, so a user must stay on one replica.
+    """
+
+    async def load_all(self) -> Dict[int, dict]:
+        return await db.fetch_user_states()
+
+    async def save(self, states: Dict[int, dict], deleted: Iterable[int]) -> None:
+        await db.save_user_states(states, list(deleted))
+
+
+class StateStore:
+    """Bounded map ``user_id -> UserState``.
+
+    The least recently used state is evicted once ``max_users`` is exceeded,
+    and states untouched for ``ttl`` seconds are dropped. With a persistent
+    backend, states changed since the last :meth:`persist` are written out.
+    """
+
+    def __init__(self, max_users: int, ttl: float, backend: Optional[StateBackend] = None) -> None:
+        self.max_users = max_users
+        self.ttl = ttl
+        self.backend = backend or StateBackend()
+        self._states: "OrderedDict[int, UserState]" = OrderedDict()
+        self._dirty: Set[int] = set()
+        self._deleted: Set[int] = set()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._states
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def get(self, user_id: int) -> UserState:
+        """Return the state of ``user_id``, creating an empty one if needed."""
+        self._evict_expired()
+        state = self._states.get(user_id)
+        if state is None:
+            return self.reset(user_id)
+        self._states.move_to_end(user_id)
+        state.touched = time.monotonic()
+        # Вызывающий код меняет состояние на месте — считаем его изменённым
+        self._dirty.add(user_id)
+        return state
+
+    def peek(self, user_id: int) -> Optional[UserState]:
+        """Return the state of ``user_id`` without creating or touching it."""
+        return self._states.get(user_id)
+
+    def reset(self, user_id: int, **fields) -> UserState:
+        """Replace the state of ``user_id`` with a fresh one."""
+        state = self._states[user_id] = UserState(**fields)
+        self._states.move_to_end(user_id)
+        self._dirty.add(user_id)
+        self._deleted.discard(user_id)
+        while len(self._states) > self.max_users:
+            self._drop(next(iter(self._states)))
+        return state
+
+    def _drop(self, user_id: int) -> None:
+        self._states.pop(user_id, None)
+        self._dirty.discard(user_id)
+        self._deleted.add(user_id)
+
+    def _evict_expired(self) -> None:
+        # OrderedDict упорядочен по последнему обращению — просроченные в начале
+        deadline = time.monotonic() - self.ttl
+        while self._states:
+            user_id, state = next(iter(self._states.items()))
+            if state.touched >= deadline:
+                break
+            self._drop(user_id)
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by all states."""
+        return sum(state.size() for state in self._states.values())
+
+    async def restore(self) -> None:
+        """Load persisted states from the backend (e.g. after a restart), keeping ``max_users``."""
+        for user_id, fields in (await self.backend.load_all()).items():
+            # Пока Mongo поднималась, пользователь мог уже начать диалог — его состояние новее
+            if user_id not in self._states:
+                self._states[user_id] = UserState(**fields)
+                # Восстановленные старше живых и вытесняются первыми
+                self._states.move_to_end(user_id, last=False)
+        self._evict_expired()
+        while len(self._states) > self.max_users:
+            self._drop(next(iter(self._states)))
+        if self._states:
+            logger.info("Восстановлено состояний пользователей: %d", len(self._states))
+
+    async def persist(self) -> None:
+        """Write states changed since the last call to the backend."""
+        if not self._dirty and not self._deleted:
+            return
+        states = {}
+        for user_id in self._dirty:
+            state = self._states.get(user_id)
+            if state is None or state.is_empty():
+                self._deleted.add(user_id)
+            else:
+                states[user_id] = state.to_dict()
+        deleted = self._deleted - set(states)
+        self._dirty, self._deleted = set(), set()
+        await self.backend.save(states, deleted)
+
+
+def create_store() -> StateStore:
+    """Build the store configured by ``STATE_BACKEND`` (``memory`` or ``mongo``)."""
+    backend = MongoStateBackend() if settings.STATE_BACKEND == "mongo" else None
+    return StateStore(settings.STATE_MAX_USERS, settings.STATE_TTL_SECONDS, backend)
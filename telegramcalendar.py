@@ -7,22 +7,91 @@
 Base methods for calendar keyboard creation and processing.
 """
 
+import base64
+import binascii
 import calendar
 import datetime
+import functools
 
 import dateutil.relativedelta
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
 import messages
+import render
 import utils
 
+WEEK_DAYS = ("Mo", "Tu", "We", "Th", "Fr", "Sa", "Su")
+
+# Сколько готовых клавиатур держим в памяти (разметка неизменяемая — её можно
+# отдавать всем пользователям, листающим тот же месяц и время)
+CALENDAR_CACHE_SIZE = 1024
+# Сколько разобранных callback_data помним: кнопки одной клавиатуры нажимают многие
+# пользователи, а результат разбора — неизменяемый кортеж
+CALLBACK_CACHE_SIZE = 4096
+
+# Компактный формат callback_data: префикс версии + base64(номер действия,
+# минуты от эпохи). Порядок ACTIONS — часть формата: новые действия только в конец.
+CALLBACK_PREFIX = "C1"
+# Префиксы, по которым callback_data относится к календарю
+CALLBACK_PREFIXES = (CALLBACK_PREFIX, messages.CALENDAR_CALLBACK + ";")
+ACTIONS = (
+    "IGNORE", "DAY", "CANCEL",
+    "PREV-YEAR", "NEXT-YEAR", "PREV-MONTH", "NEXT-MONTH",
+    "PREV-HOUR", "NEXT-HOUR", "PREV-MIN", "NEXT-MIN",
+)
+_ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+_MINUTES_SIZE = 5  # 40 бит со знаком покрывают годы 1..9999
+_MINUTES_MASK = (1 << 8 * _MINUTES_SIZE) - 1
+_EPOCH = datetime.datetime(1970, 1, 1)
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+_MINUTE = datetime.timedelta(minutes=1)
+_URLSAFE = bytes.maketrans(b"+/", b"-_")
+# IGNORE-кнопкам дата не нужна: callback_data без даты одна на действие
+_NO_DATE = {
+    action: CALLBACK_PREFIX + base64.urlsafe_b64encode(bytes((code,))).rstrip(b"=").decode()
+    for action, code in _ACTION_CODES.items()
+}
+
+
+@functools.lru_cache(maxsize=CALENDAR_CACHE_SIZE)
+def _month_minutes(year, month):
+    """Minutes from the epoch to the first day of the month."""
+    return (datetime.date(year, month, 1).toordinal() - _EPOCH_ORDINAL) * 1440
+
 
 def create_callback_data(action, year, month, day, curHour, curMin):
     """Create the callback data associated to each button"""
-    return (
-        messages.CALENDAR_CALLBACK
-        + ";"
-        + ";".join([action, str(year), str(month), str(day), str(curHour), str(curMin)])
+    if not day:
+        return _NO_DATE[action]
+    minutes = _month_minutes(year, month) + (day - 1) * 1440 + curHour * 60 + curMin
+    # Номер действия и минуты в дополнительном коде — одно 48-битное число, 8 символов base64
+    payload = (_ACTION_CODES[action] << 8 * _MINUTES_SIZE | minutes & _MINUTES_MASK).to_bytes(
+        _MINUTES_SIZE + 1, "big"
+    )
+    return CALLBACK_PREFIX + binascii.b2a_base64(payload, newline=False).translate(_URLSAFE).decode()
+
+
+@functools.lru_cache(maxsize=CALLBACK_CACHE_SIZE)
+def parse_callback_data(data):
+    """
+    Return ``(action, date)`` from calendar callback data; ``date`` is None
+    for buttons without one. The legacy ``CALENDAR;ACTION;y;m;d;h;min``
+    format is still accepted for keyboards sent before the switch.
+    """
+    if data.startswith(CALLBACK_PREFIX):
+        encoded = data[len(CALLBACK_PREFIX):]
+        payload = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+        if len(payload) == 1:
+            return ACTIONS[payload[0]], None
+        minutes = int.from_bytes(payload[1:], "big", signed=True)
+        return ACTIONS[payload[0]], _EPOCH + minutes * _MINUTE
+    (prefix, action, year, month, day, hour, minute) = utils.separate_callback_data(data)
+    if prefix != messages.CALENDAR_CALLBACK:
+        raise ValueError(f"Unknown callback data: {data!r}")
+    if day == "0":
+        return action, None
+    return action, datetime.datetime(
+        year=int(year), month=int(month), day=int(day), hour=int(hour), minute=int(minute)
     )
 
 
@@ -30,207 +99,148 @@ def create_calendar(cur=None):
     """
     Create an inline keyboard with the provided year and month
     """
-    now = datetime.datetime.now()
     if cur == None:
-        cur = now
-    data_ignore = create_callback_data(
-        "IGNORE", cur.year, cur.month, 0, cur.hour, cur.minute
-    )
-    keyboard = []
-    row = []
-    row.append(
+        cur = datetime.datetime.now()
+    return _build_calendar(cur.year, cur.month, cur.day, cur.hour, cur.minute)
+
+
+def _nav_row(label, prev_action, next_action, year, month, day, hour, minute, data_ignore):
+    return (
         InlineKeyboardButton(
             "<",
-            callback_data=create_callback_data(
-                "PREV-YEAR", cur.year, cur.month, cur.day, cur.hour, cur.minute
-            ),
-        )
-    )
-    row.append(InlineKeyboardButton(f"YEAR:{cur.year}", callback_data=data_ignore))
-    row.append(
+            callback_data=create_callback_data(prev_action, year, month, day, hour, minute),
+        ),
+        InlineKeyboardButton(label, callback_data=data_ignore),
         InlineKeyboardButton(
             ">",
-            callback_data=create_callback_data(
-                "NEXT-YEAR", cur.year, cur.month, cur.day, cur.hour, cur.minute
-            ),
-        )
+            callback_data=create_callback_data(next_action, year, month, day, hour, minute),
+        ),
     )
-    keyboard.append(row)
-
-    # Second row - Week Days
-    row = []
-    for day in ["Mo", "Tu", "We", "Th", "Fr", "Sa", "Su"]:
-        row.append(InlineKeyboardButton(day, callback_data=data_ignore))
-    keyboard.append(row)
-
-    my_calendar = calendar.monthcalendar(cur.year, cur.month)
-    for week in my_calendar:
-        row = []
-        for day in week:
-            if day == 0:
-                row.append(InlineKeyboardButton(" ", callback_data=data_ignore))
-            else:
-                row.append(
-                    InlineKeyboardButton(
-                        str(day),
-                        callback_data=create_callback_data(
-                            "DAY", cur.year, cur.month, day, cur.hour, cur.minute
-                        ),
-                    )
+
+
+@functools.lru_cache(maxsize=CALENDAR_CACHE_SIZE)
+def _grid_rows(year, month, hour, minute):
+    """Week-day header and day grid: the same for every day of the month."""
+    data_ignore = create_callback_data("IGNORE", year, month, 0, hour, minute)
+    rows = [tuple(InlineKeyboardButton(day, callback_data=data_ignore) for day in WEEK_DAYS)]
+    for week in calendar.monthcalendar(year, month):
+        rows.append(
+            tuple(
+                InlineKeyboardButton(" ", callback_data=data_ignore)
+                if day == 0
+                else InlineKeyboardButton(
+                    str(day),
+                    callback_data=create_callback_data("DAY", year, month, day, hour, minute),
                 )
-        keyboard.append(row)
-    # row - Buttons
-    row = []
-    row.append(
-        InlineKeyboardButton(
-            "<",
-            callback_data=create_callback_data(
-                "PREV-MONTH", cur.year, cur.month, cur.day, cur.hour, cur.minute
-            ),
-        )
-    )
-    row.append(
-        InlineKeyboardButton(
-            f"{calendar.month_name[cur.month]}", callback_data=data_ignore
-        )
-    )
-    row.append(
-        InlineKeyboardButton(
-            ">",
-            callback_data=create_callback_data(
-                "NEXT-MONTH", cur.year, cur.month, cur.day, cur.hour, cur.minute
-            ),
-        )
-    )
-    keyboard.append(row)
-    row = []
-    row.append(
-        InlineKeyboardButton(
-            "<",
-            callback_data=create_callback_data(
-                "PREV-HOUR", cur.year, cur.month, cur.day, cur.hour, cur.minute
-            ),
-        )
-    )
-    row.append(InlineKeyboardButton(f"HOUR:{cur.hour}", callback_data=data_ignore))
-    row.append(
-        InlineKeyboardButton(
-            ">",
-            callback_data=create_callback_data(
-                "NEXT-HOUR", cur.year, cur.month, cur.day, cur.hour, cur.minute
-            ),
-        )
-    )
-    keyboard.append(row)
-    row = []
-    row.append(
-        InlineKeyboardButton(
-            "<",
-            callback_data=create_callback_data(
-                "PREV-MIN", cur.year, cur.month, cur.day, cur.hour, cur.minute
-            ),
-        )
-    )
-    row.append(InlineKeyboardButton(f"MIN:{cur.minute}", callback_data=data_ignore))
-    row.append(
-        InlineKeyboardButton(
-            ">",
-            callback_data=create_callback_data(
-                "NEXT-MIN", cur.year, cur.month, cur.day, cur.hour, cur.minute
-            ),
+                for day in week
+            )
         )
-    )
-    keyboard.append(row)
-    row = []
-    row.append(
-        InlineKeyboardButton(
-            "CANCEL",
-            callback_data=create_callback_data(
-                "CANCEL", cur.year, cur.month, cur.day, cur.hour, cur.minute
+    return tuple(rows)
+
+
+@functools.lru_cache(maxsize=CALENDAR_CACHE_SIZE)
+def _build_calendar(year, month, day, hour, minute):
+    data_ignore = create_callback_data("IGNORE", year, month, 0, hour, minute)
+    args = (year, month, day, hour, minute, data_ignore)
+    keyboard = [_nav_row(f"YEAR:{year}", "PREV-YEAR", "NEXT-YEAR", *args)]
+    keyboard.extend(_grid_rows(year, month, hour, minute))
+    keyboard.append(_nav_row(f"{calendar.month_name[month]}", "PREV-MONTH", "NEXT-MONTH", *args))
+    keyboard.append(_nav_row(f"HOUR:{hour}", "PREV-HOUR", "NEXT-HOUR", *args))
+    keyboard.append(_nav_row(f"MIN:{minute}", "PREV-MIN", "NEXT-MIN", *args))
+    keyboard.append(
+        (
+            InlineKeyboardButton(
+                "CANCEL",
+                callback_data=create_callback_data("CANCEL", year, month, day, hour, minute),
             ),
         )
     )
-    keyboard.append(row)
     return InlineKeyboardMarkup(keyboard)
 
 
 async def _safe_edit_calendar(query, context, new_date):
     try:
-        await context.bot.edit_message_text(
-            text=query.message.text,
-            chat_id=query.message.chat.id,
-            message_id=query.message.message_id,
-            reply_markup=create_calendar(new_date),
+        await render.edit_message(
+            context.bot,
+            query.message.chat.id,
+            query.message.message_id,
+            query.message.text,
+            create_calendar(new_date),
+            shown=query.message,
+        )
+    except Exception:
+        await context.bot.answer_callback_query(
+            callback_query_id=query.id,
+            text="Не удалось обновить календарь. Попробуйте ещё раз.",
+            show_alert=True,
+        )
+
+
+async def _ignore(query, context, curr):
+    return (False, None)
+
+
+async def _select_day(query, context, curr):
+    try:
+        await render.edit_message(
+            context.bot,
+            query.message.chat.id,
+            query.message.message_id,
+            query.message.text,
+            shown=query.message,
         )
+        return (True, curr)
     except Exception:
         await context.bot.answer_callback_query(
             callback_query_id=query.id,
             text="Не удалось обновить календарь. Попробуйте ещё раз.",
             show_alert=True,
         )
+        return (False, None)
 
 
-async def process_calendar_selection(update, context):
+async def _cancel(query, context, curr):
+    return (True, "CANCEL")
+
+
+# Навигация: действие -> сдвиг показываемой даты
+CALENDAR_STEPS = {
+    "PREV-YEAR": dateutil.relativedelta.relativedelta(years=-1),
+    "NEXT-YEAR": dateutil.relativedelta.relativedelta(years=1),
+    "PREV-MONTH": dateutil.relativedelta.relativedelta(months=-1),
+    "NEXT-MONTH": dateutil.relativedelta.relativedelta(months=1),
+    "PREV-HOUR": dateutil.relativedelta.relativedelta(hours=-1),
+    "NEXT-HOUR": dateutil.relativedelta.relativedelta(hours=1),
+    "PREV-MIN": dateutil.relativedelta.relativedelta(minutes=-1),
+    "NEXT-MIN": dateutil.relativedelta.relativedelta(minutes=1),
+}
+
+# Остальные действия: action -> handler(query, context, date) -> (selected, date)
+CALENDAR_SELECTIONS = {
+    "IGNORE": _ignore,
+    "DAY": _select_day,
+    "CANCEL": _cancel,
+}
+
+
+async def process_calendar_selection(update, context, parsed=None):
     """
     Process the callback_query for the calendar.
+
+    ``parsed`` is the ``(action, date)`` already decoded from the callback
+    data; it is parsed here when omitted.
     """
-    ret_data = (False, None)
     query = update.callback_query
     await query.answer()
-    (_, action, curYear, curMonth, curDay, curHour, curMin) = (
-        utils.separate_callback_data(query.data)
-    )
-    curr = datetime.datetime(
-        year=int(curYear),
-        month=int(curMonth),
-        day=int(curDay),
-        hour=int(curHour),
-        minute=int(curMin),
-    )
-    if action == "IGNORE":
-        pass
-    elif action == "DAY":
-        try:
-            await context.bot.edit_message_text(
-                text=query.message.text,
-                chat_id=query.message.chat.id,
-                message_id=query.message.message_id,
-            )
-            ret_data = (True, curr)
-        except Exception:
-            await context.bot.answer_callback_query(
-                callback_query_id=query.id,
-                text="Не удалось обновить календарь. Попробуйте ещё раз.",
-                show_alert=True,
-            )
-    elif action == "PREV-MONTH":
-        pre = curr - dateutil.relativedelta.relativedelta(months=1)
-        await _safe_edit_calendar(query, context, pre)
-    elif action == "NEXT-MONTH":
-        ne = curr + dateutil.relativedelta.relativedelta(months=1)
-        await _safe_edit_calendar(query, context, ne)
-    elif action == "PREV-HOUR":
-        pre = curr - dateutil.relativedelta.relativedelta(hours=1)
-        await _safe_edit_calendar(query, context, pre)
-    elif action == "NEXT-HOUR":
-        ne = curr + dateutil.relativedelta.relativedelta(hours=1)
-        await _safe_edit_calendar(query, context, ne)
-    elif action == "PREV-MIN":
-        pre = curr - dateutil.relativedelta.relativedelta(minutes=1)
-        await _safe_edit_calendar(query, context, pre)
-    elif action == "NEXT-MIN":
-        ne = curr + dateutil.relativedelta.relativedelta(minutes=1)
-        await _safe_edit_calendar(query, context, ne)
-    elif action == "PREV-YEAR":
-        pre = curr - dateutil.relativedelta.relativedelta(years=1)
-        await _safe_edit_calendar(query, context, pre)
-    elif action == "NEXT-YEAR":
-        ne = curr + dateutil.relativedelta.relativedelta(years=1)
-        await _safe_edit_calendar(query, context, ne)
-    elif action == "CANCEL":
-        ret_data = (True, "CANCEL")
-    else:
+    action, curr = parsed or parse_callback_data(query.data)
+    step = CALENDAR_STEPS.get(action)
+    if step is not None:
+        await _safe_edit_calendar(query, context, curr + step)
+        return (False, None)
+    handler = CALENDAR_SELECTIONS.get(action)
+    if handler is None:
         await context.bot.send_message(
             chat_id=query.message.chat.id, text="Something went wrong!"
         )
-    return ret_data
+        return (False, None)
+    return await handler(query, context, curr)
@@ -0,0 +1,13 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Настройки читаются при импорте config: без обязательных полей модули бота не импортируются
+for _name, _value in {
+    "TOKEN": "123456:test",
+    "DB_NAME": "test",
+    "COLLECTION_NAME": "test",
+    "MONGO_HOST": "localhost",
+}.items():
+    os.environ.setdefault(_name, _value)
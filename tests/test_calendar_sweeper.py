@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+
+import handlers
+from state import StateStore
+
+
+class FakeStore:
+    def __init__(self, jobs=()):
+        self.jobs = list(jobs)
+        self.scheduled = []
+        self.cancelled = []
+
+    def schedule(self, kind, key, run_at, data):
+        self.scheduled.append((key, run_at))
+
+    def cancel(self, kind, key, run_at):
+        self.cancelled.append((key, run_at))
+
+    async def load(self, kind):
+        return self.jobs
+
+
+class FakeJobQueue:
+    def __init__(self):
+        self.delays = []
+
+    def run_once(self, callback, when, name=None):
+        self.delays.append(when)
+        return object()
+
+
+class FakeBot:
+    def __init__(self):
+        self.deleted = []
+        self.sent = []
+
+    async def delete_message(self, chat_id, message_id):
+        self.deleted.append((chat_id, message_id))
+
+    async def send_message(self, chat_id, text):
+        self.sent.append(chat_id)
+
+
+class FakeContext:
+    def __init__(self, job_queue):
+        self.bot = FakeBot()
+        self.job_queue = job_queue
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(handlers.time, "time", lambda: clock[0])
+    return clock
+
+
+@pytest.fixture
+def states(monkeypatch):
+    states = StateStore(max_users=100, ttl=3600)
+    monkeypatch.setattr(handlers, "user_states", states)
+    return states
+
+
+@pytest.fixture
+def store():
+    return FakeStore()
+
+
+@pytest.fixture
+def sweeper(monkeypatch, store):
+    sweeper = handlers.CalendarSweeper(30, store)
+    monkeypatch.setattr(handlers, "calendar_sweeper", sweeper)
+    return sweeper
+
+
+def open_calendar(states, user_id):
+    return states.reset(user_id, data_chat_id=user_id, data_message_id=user_id + 1, waiting_for_date="date?")
+
+
+def sweep(job_queue):
+    context = FakeContext(job_queue)
+    asyncio.run(handlers.sweep_calendars(context))
+    return context.bot
+
+
+def test_calendar_expires_after_timeout(clock, states, store, sweeper):
+    job_queue = FakeJobQueue()
+    sweeper.track(1, open_calendar(states, 1), job_queue)
+    assert job_queue.delays == [30]
+    assert store.scheduled == [(1, 1030.0)]
+    clock[0] = 1030.0
+    bot = sweep(job_queue)
+    assert bot.deleted == [(1, 2)] and bot.sent == [1]
+    assert not states.peek(1).waiting_for_date
+    assert store.cancelled == [(1, 1030.0)]
+    assert len(sweeper) == 0
+
+
+def test_navigation_extends_deadline(clock, states, sweeper):
+    job_queue = FakeJobQueue()
+    state = open_calendar(states, 1)
+    sweeper.track(1, state, job_queue)
+    clock[0] = 1010.0
+    sweeper.track(1, state, job_queue)
+    # Вторая запись не перепланирует sweep: новый срок позже уже запланированного
+    assert job_queue.delays == [30]
+    clock[0] = 1030.0
+    bot = sweep(job_queue)
+    # Устаревшая запись 1030 пропущена, календарь жив до 1040
+    assert bot.deleted == []
+    assert states.peek(1).waiting_for_date
+    assert job_queue.delays == [30, 10]
+    clock[0] = 1040.0
+    bot = sweep(job_queue)
+    assert bot.deleted == [(1, 2)]
+
+
+def test_answered_calendar_is_not_expired(clock, states, sweeper):
+    job_queue = FakeJobQueue()
+    sweeper.track(1, open_calendar(states, 1), job_queue)
+    states.reset(1)
+    clock[0] = 1030.0
+    bot = sweep(job_queue)
+    assert bot.deleted == [] and bot.sent == []
+
+
+def test_restore(clock, states, store, sweeper):
+    store.jobs = [
+        {"key": 1, "run_at": 1020.0, "chat_id": 10, "message_id": 11},
+        {"key": 2, "run_at": 1005.0, "chat_id": 20, "message_id": 21},
+        {"key": 3, "run_at": 1010.0, "chat_id": 30, "message_id": 31},
+    ]
+    # Состояние 1 не сохранялось, 2 ждёт дату, 3 уже выбрал её до рестарта
+    open_calendar(states, 2)
+    states.reset(3, date="CANCEL")
+    job_queue = FakeJobQueue()
+    asyncio.run(sweeper.restore(job_queue))
+
+    assert store.cancelled == [(3, 1010.0)]
+    assert len(sweeper) == 2
+    assert (states.peek(1).data_chat_id, states.peek(1).data_message_id) == (10, 11)
+    assert states.peek(1).calendar_deadline == 1020.0
+    assert job_queue.delays == [5.0]
+
+    clock[0] = 1020.0
+    bot = sweep(job_queue)
+    assert sorted(bot.deleted) == [(2, 3), (10, 11)]
+
+
+def test_restore_keeps_running_sweep(clock, states, store, sweeper):
+    job_queue = FakeJobQueue()
+    sweeper.track(1, open_calendar(states, 1), job_queue)
+    store.jobs = [{"key": 2, "run_at": 1005.0, "chat_id": 20, "message_id": 21}]
+    asyncio.run(sweeper.restore(job_queue))
+    assert job_queue.delays == [30]
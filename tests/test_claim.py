@@ -0,0 +1,73 @@
+import asyncio
+import datetime
+
+import pytest
+
+import db
+
+mongomock = pytest.importorskip("mongomock")
+
+NOW = datetime.datetime(2026, 10, 18, 14, 35)
+LEASE = NOW + datetime.timedelta(seconds=60)
+
+
+@pytest.fixture
+def coll(monkeypatch):
+    coll = mongomock.MongoClient()["test"]["reminders"]
+    monkeypatch.setattr(db.mongo, "_collection", coll)
+    return coll
+
+
+def add(coll, message_id, minutes_ago, **fields):
+    coll.insert_one({
+        "chat_id": 1,
+        "message_id": message_id,
+        "due_at": NOW - datetime.timedelta(minutes=minutes_ago),
+        **fields,
+    })
+
+
+def claim(owner, limit=10, now=NOW):
+    return asyncio.run(db.claim_due_reminders(now - db.REMINDER_TTL, now, owner, LEASE, limit))
+
+
+def ids(records):
+    return sorted(rec["message_id"] for rec in records)
+
+
+def test_claims_due_records_earliest_first(coll):
+    add(coll, 1, 1)
+    add(coll, 2, 5)
+    add(coll, 3, -5)  # ещё не наступило
+    add(coll, 4, 60 * 25)  # старше окна догоняния
+    assert [rec["message_id"] for rec in claim("a", limit=1)] == [2]
+    assert ids(claim("b")) == [1]
+    assert coll.find_one({"message_id": 2})["lease_owner"] == "a"
+
+
+def test_leased_record_is_not_claimed_twice(coll):
+    for message_id in range(5):
+        add(coll, message_id, 1)
+    first, second = claim("a"), claim("b")
+    assert ids(first) == list(range(5))
+    assert second == []
+
+
+def test_concurrent_claims_are_disjoint(coll):
+    for message_id in range(50):
+        add(coll, message_id, 1)
+
+    async def main():
+        return await asyncio.gather(*(
+            db.claim_due_reminders(NOW - db.REMINDER_TTL, NOW, owner, LEASE, 20) for owner in "abcd"
+        ))
+
+    claimed = [rec["message_id"] for records in asyncio.run(main()) for rec in records]
+    assert len(claimed) == len(set(claimed))
+
+
+def test_expired_and_released_leases_are_claimed_again(coll):
+    add(coll, 1, 1, lease_owner="dead", lease_until=NOW - datetime.timedelta(seconds=1))
+    add(coll, 2, 1, lease_owner="live", lease_until=LEASE)
+    add(coll, 3, 1, **db.release_fields())
+    assert ids(claim("a")) == [1, 3]
@@ -0,0 +1,39 @@
+import pytest
+
+import db
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture
+def coll():
+    return mongomock.MongoClient()["test"]["reminders"]
+
+
+def test_dedupe_keeps_last_copy(coll):
+    coll.insert_many([
+        {"chat_id": 1, "message_id": 57, "message": "old"},
+        {"chat_id": 1, "message_id": 57, "message": "new"},
+        {"chat_id": 2, "message_id": 57, "message": "other chat"},
+    ])
+    assert db.dedupe_reminders(coll) == 1
+    assert sorted(rec["message"] for rec in coll.find()) == ["new", "other chat"]
+    assert db.ensure_indexes(coll)
+
+
+def test_dedupe_skipped_once_index_exists(coll):
+    assert db.ensure_indexes(coll)
+    assert db.dedupe_reminders(coll) == 0
+
+
+def test_ping_retries_indexes_until_built(monkeypatch, coll):
+    connection = db.MongoConnection()
+    connection._collection = coll
+    monkeypatch.setattr(db, "dedupe_reminders", lambda coll: 0)
+    coll.insert_many([{"chat_id": 1, "message_id": 57}, {"chat_id": 1, "message_id": 57}])
+    connection.ping()
+    assert not connection._indexes_ready
+    coll.delete_one({"chat_id": 1})
+    connection.ping()
+    assert connection._indexes_ready
+    assert "chat_message" in coll.index_information()
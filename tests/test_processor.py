@@ -0,0 +1,86 @@
+import asyncio
+
+from telegram import Update
+
+from processor import PerUserUpdateProcessor
+
+
+def make_update(update_id, user_id):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+            "text": "hi",
+        },
+    }, None)
+
+
+def run(processor, updates, handle):
+    async def main():
+        await processor.initialize()
+        await asyncio.gather(*(processor.process_update(update, handle(update)) for update in updates))
+        await processor.shutdown()
+
+    asyncio.run(main())
+
+
+def test_updates_of_one_user_run_in_order():
+    log = []
+
+    async def handle(update):
+        log.append(("start", update.update_id))
+        # Первое обновление дольше: без очереди пользователя второе обогнало бы его
+        await asyncio.sleep(0.05 if update.update_id == 1 else 0)
+        log.append(("end", update.update_id))
+
+    processor = PerUserUpdateProcessor(max_concurrent_updates=4, max_pending_updates=16)
+    run(processor, [make_update(i, 7) for i in (1, 2, 3)], handle)
+    assert log == [("start", 1), ("end", 1), ("start", 2), ("end", 2), ("start", 3), ("end", 3)]
+    assert processor.queue_lengths == {} and processor._locks == {}
+
+
+def test_users_run_concurrently():
+    running = set()
+    overlap = []
+
+    async def handle(update):
+        running.add(update.effective_user.id)
+        overlap.append(len(running))
+        await asyncio.sleep(0.02)
+        running.discard(update.effective_user.id)
+
+    processor = PerUserUpdateProcessor(max_concurrent_updates=4, max_pending_updates=16)
+    run(processor, [make_update(i, user_id) for i, user_id in enumerate((1, 2, 3), 1)], handle)
+    assert max(overlap) == 3
+
+
+def test_max_concurrent_updates_is_a_cap():
+    running = [0]
+    peak = [0]
+
+    async def handle(update):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+
+    processor = PerUserUpdateProcessor(max_concurrent_updates=2, max_pending_updates=16)
+    run(processor, [make_update(i, i) for i in range(1, 7)], handle)
+    assert peak[0] == 2
+
+
+def test_waiting_update_does_not_take_a_running_slot():
+    log = []
+
+    async def handle(update):
+        log.append(update.update_id)
+        await asyncio.sleep(0.05 if update.update_id == 1 else 0)
+
+    # Один слот: обновление 2 ждёт обновление 1 того же пользователя, а 3 (другой пользователь)
+    # не должно стоять за ним
+    processor = PerUserUpdateProcessor(max_concurrent_updates=1, max_pending_updates=16)
+    run(processor, [make_update(1, 7), make_update(2, 7), make_update(3, 8)], handle)
+    assert log.index(3) < log.index(2)
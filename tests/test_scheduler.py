@@ -0,0 +1,128 @@
+import asyncio
+import datetime
+
+import pytest
+
+import scheduler
+from config import settings
+
+
+class FakeJob:
+    def __init__(self, when):
+        self.when = when
+        self.removed = False
+
+    def schedule_removal(self):
+        self.removed = True
+
+
+class FakeJobQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when, name=None):
+        job = FakeJob(when)
+        self.jobs.append(job)
+        return job
+
+
+class FakeApp:
+    def __init__(self):
+        self.job_queue = FakeJobQueue()
+
+
+@pytest.fixture
+def now():
+    return datetime.datetime.now()
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    monkeypatch.setattr(settings, "SCHEDULER_SWEEP_SECONDS", 0)
+    queue = scheduler.ReminderQueue()
+    queue._app = FakeApp()
+    return queue
+
+
+def load(queue, monkeypatch, now, entries):
+    async def fetch_schedule(start, end, limit=0):
+        return [((7, message_id), due_at) for message_id, due_at in entries if start <= due_at <= end][:limit or None]
+
+    monkeypatch.setattr(scheduler, "fetch_schedule", fetch_schedule)
+    asyncio.run(queue.load(now))
+
+
+def test_stale_entries_are_skipped(queue, now):
+    queue.push(7, 1, now + datetime.timedelta(minutes=1))
+    queue.push(7, 1, now + datetime.timedelta(minutes=5))
+    queue.push(7, 2, now + datetime.timedelta(minutes=3))
+    queue.push(7, 2, None)
+    assert queue.next_due() == now + datetime.timedelta(minutes=5)
+    assert len(queue) == 1
+    assert queue.pop_due(now + datetime.timedelta(minutes=4)) == 0
+    assert queue.pop_due(now + datetime.timedelta(minutes=5)) == 1
+    assert queue.next_due() is None
+
+
+def test_same_message_id_in_other_chat_is_kept(queue, now):
+    queue.push(7, 57, now + datetime.timedelta(minutes=1))
+    queue.push(8, 57, None)
+    assert len(queue) == 1
+    assert queue.next_due() == now + datetime.timedelta(minutes=1)
+
+
+def test_push_arms_earliest_due(queue, now):
+    jobs = queue._app.job_queue.jobs
+    queue.push(7, 1, now + datetime.timedelta(minutes=10))
+    assert len(jobs) == 1 and jobs[0].when == pytest.approx(600, abs=5)
+    # Более поздний срок не перезапускает уже запланированный pop_job
+    queue.push(7, 2, now + datetime.timedelta(minutes=20))
+    assert len(jobs) == 1
+    queue.push(7, 3, now + datetime.timedelta(minutes=1))
+    assert len(jobs) == 2 and jobs[0].removed
+    assert jobs[1].when == pytest.approx(60, abs=5)
+
+
+def test_no_arm_while_tick_runs(queue, now):
+    queue._running = True
+    queue.push(7, 1, now + datetime.timedelta(minutes=1))
+    assert queue._app.job_queue.jobs == []
+    queue.end_tick()
+    assert len(queue._app.job_queue.jobs) == 1
+
+
+def test_load_drops_pushes_beyond_horizon(queue, monkeypatch, now):
+    load(queue, monkeypatch, now, [
+        (1, now + datetime.timedelta(minutes=5)),
+        (2, now + scheduler.SCHEDULE_HORIZON + datetime.timedelta(minutes=5)),
+    ])
+    assert len(queue) == 1
+    assert queue._loaded_until == now + scheduler.SCHEDULE_HORIZON
+    queue.push(7, 3, now + scheduler.SCHEDULE_HORIZON + datetime.timedelta(minutes=1))
+    queue.push(7, 1, now + scheduler.SCHEDULE_HORIZON + datetime.timedelta(minutes=1))
+    assert len(queue) == 0
+    # Пробуждение на границе окна, чтобы догрузить расписание
+    queue._arm()
+    assert queue._armed_at == now + scheduler.SCHEDULE_HORIZON
+
+
+def test_full_batch_cuts_window_at_last_due(queue, monkeypatch, now):
+    monkeypatch.setattr(scheduler, "SCHEDULE_BATCH", 2)
+    entries = [(message_id, now + datetime.timedelta(minutes=message_id)) for message_id in range(1, 5)]
+    load(queue, monkeypatch, now, entries)
+    assert queue._loaded_until == now + datetime.timedelta(minutes=2)
+    queue.push(7, 3, now + datetime.timedelta(minutes=3))
+    assert len(queue) == 2
+
+
+def test_failed_tick_retries_soon(queue, monkeypatch, now):
+    async def claim_due_reminders(*args):
+        raise asyncio.TimeoutError()
+
+    monkeypatch.setattr(scheduler, "claim_due_reminders", claim_due_reminders)
+    monkeypatch.setattr(scheduler, "reminder_queue", queue)
+    load(queue, monkeypatch, now, [(1, now)])
+    asyncio.run(scheduler.pop_job(None))
+    jobs = queue._app.job_queue.jobs
+    assert not queue._running
+    assert jobs[-1].when == pytest.approx(scheduler.TICK_RETRY.total_seconds(), abs=1)
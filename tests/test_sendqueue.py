@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import pytest
+from telegram.error import RetryAfter
+
+from sendqueue import SendQueue, TokenBucket
+
+
+def make_queue(**overrides):
+    options = dict(global_rate=1000, per_chat_rate=1000, per_chat_burst=1000, concurrency=4, max_retries=2)
+    options.update(overrides)
+    return SendQueue(**options)
+
+
+class FloodedMethod:
+    """Bot API method that answers RetryAfter ``floods`` times, then succeeds."""
+
+    __name__ = "send_message"
+
+    def __init__(self, floods, retry_after=0.1):
+        self.floods = floods
+        self.retry_after = retry_after
+        self.called_at = []
+
+    async def __call__(self, value):
+        self.called_at.append(time.monotonic())
+        if len(self.called_at) <= self.floods:
+            raise RetryAfter(self.retry_after)
+        return value
+
+
+def test_retry_after_pauses_and_retries():
+    queue = make_queue()
+    method = FloodedMethod(floods=1)
+    assert asyncio.run(queue.call(1, method, "ok")) == "ok"
+    assert method.called_at[1] - method.called_at[0] >= method.retry_after
+    assert queue.calls["send_message"] == 2
+    assert queue.depth == 0
+
+
+def test_retry_after_pauses_other_chats():
+    queue = make_queue()
+    flooded = FloodedMethod(floods=1)
+    other = FloodedMethod(floods=0)
+
+    async def main():
+        first = asyncio.create_task(queue.call(1, flooded, "a"))
+        await asyncio.sleep(0.01)
+        await queue.call(2, other, "b")
+        await first
+
+    asyncio.run(main())
+    assert other.called_at[0] - flooded.called_at[0] >= flooded.retry_after
+
+
+def test_gives_up_after_max_retries():
+    queue = make_queue(max_retries=2)
+    method = FloodedMethod(floods=3, retry_after=0.01)
+    with pytest.raises(RetryAfter):
+        asyncio.run(queue.call(1, method, "ok"))
+    assert len(method.called_at) == 3
+    assert queue.depth == 0
+
+
+def test_per_chat_rate():
+    queue = make_queue(per_chat_rate=20, per_chat_burst=1)
+    method = FloodedMethod(floods=0)
+
+    async def main():
+        await asyncio.gather(*(queue.call(1, method, i) for i in range(3)))
+
+    asyncio.run(main())
+    assert method.called_at[-1] - method.called_at[0] >= 2 / 20 * 0.9
+
+
+def test_token_bucket_delay():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.delay() == 0 and bucket.delay() == 0
+    assert bucket.delay() == pytest.approx(0.1, abs=0.01)
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+import state
+from state import StateBackend, StateStore
+
+
+class MemoryBackend(StateBackend):
+    def __init__(self, stored=None):
+        self.stored = dict(stored or {})
+        self.saves = []
+
+    async def load_all(self):
+        return dict(self.stored)
+
+    async def save(self, states, deleted):
+        self.saves.append((states, set(deleted)))
+        self.stored.update(states)
+        for user_id in deleted:
+            self.stored.pop(user_id, None)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(state.time, "monotonic", lambda: clock[0])
+    return clock
+
+
+def test_least_recently_used_is_evicted(clock):
+    store = StateStore(max_users=2, ttl=3600)
+    store.get(1)
+    store.get(2)
+    store.get(1)
+    store.get(3)
+    assert 1 in store and 3 in store and 2 not in store
+
+
+def test_peek_does_not_touch(clock):
+    store = StateStore(max_users=2, ttl=3600)
+    store.get(1)
+    store.get(2)
+    assert store.peek(1) is not None
+    store.get(3)
+    assert 1 not in store and store.peek(4) is None and 4 not in store
+
+
+def test_untouched_states_expire(clock):
+    store = StateStore(max_users=10, ttl=60)
+    store.get(1)
+    clock[0] += 30
+    store.get(2)
+    clock[0] += 31
+    store.get(3)
+    assert 1 not in store and 2 in store and 3 in store
+
+
+def test_persist_writes_changes_and_deletions(clock):
+    backend = MemoryBackend()
+    store = StateStore(max_users=1, ttl=3600, backend=backend)
+    store.get(1).date = "CANCEL"
+    asyncio.run(store.persist())
+    assert backend.stored == {1: {"date": "CANCEL"}}
+    store.get(2).date = "CANCEL"
+    asyncio.run(store.persist())
+    assert backend.stored == {2: {"date": "CANCEL"}}
+    # Пустое состояние не хранится
+    store.reset(2)
+    asyncio.run(store.persist())
+    assert backend.stored == {}
+    asyncio.run(store.persist())
+    assert len(backend.saves) == 3
+
+
+def test_restore_keeps_live_states_and_max_users(clock):
+    backend = MemoryBackend({user_id: {"date": f"restored {user_id}"} for user_id in range(5)})
+    store = StateStore(max_users=3, ttl=3600, backend=backend)
+    store.get(1).date = "live"
+    asyncio.run(store.restore())
+    assert len(store) == 3
+    assert store.peek(1).date == "live"
+    # Восстановленные вытесняются раньше живых
+    store.get(10)
+    assert 1 in store and 10 in store
@@ -0,0 +1,52 @@
+import datetime
+
+import pytest
+
+import messages
+import telegramcalendar
+
+
+@pytest.mark.parametrize("action", telegramcalendar.ACTIONS)
+@pytest.mark.parametrize(
+    "date",
+    [
+        datetime.datetime(2026, 10, 18, 14, 35),
+        datetime.datetime(2024, 2, 29, 23, 59),
+        datetime.datetime(1969, 12, 31, 0, 0),
+        datetime.datetime(1, 1, 1, 0, 0),
+        datetime.datetime(9999, 12, 31, 23, 59),
+    ],
+)
+def test_round_trip(action, date):
+    data = telegramcalendar.create_callback_data(action, date.year, date.month, date.day, date.hour, date.minute)
+    assert data.startswith(telegramcalendar.CALLBACK_PREFIX)
+    assert len(data.encode()) <= 64
+    assert telegramcalendar.parse_callback_data(data) == (action, date)
+
+
+def test_round_trip_without_date():
+    data = telegramcalendar.create_callback_data("IGNORE", 2026, 10, 0, 14, 35)
+    assert telegramcalendar.parse_callback_data(data) == ("IGNORE", None)
+
+
+def test_parse_legacy():
+    data = f"{messages.CALENDAR_CALLBACK};NEXT-MONTH;2026;10;18;14;35"
+    assert telegramcalendar.parse_callback_data(data) == ("NEXT-MONTH", datetime.datetime(2026, 10, 18, 14, 35))
+
+
+def test_parse_legacy_without_date():
+    data = f"{messages.CALENDAR_CALLBACK};IGNORE;2026;10;0;14;35"
+    assert telegramcalendar.parse_callback_data(data) == ("IGNORE", None)
+
+
+def test_parse_unknown_prefix():
+    with pytest.raises(ValueError):
+        telegramcalendar.parse_callback_data("OTHER;DAY;2026;10;18;14;35")
+
+
+def test_calendar_buttons_parse():
+    markup = telegramcalendar.create_calendar(datetime.datetime(2026, 10, 18, 14, 35))
+    for row in markup.inline_keyboard:
+        for button in row:
+            action, _ = telegramcalendar.parse_callback_data(button.callback_data)
+            assert action in telegramcalendar.ACTIONS
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import web
+from config import settings
+
+SECRET = {"X-Telegram-Bot-Api-Secret-Token": "secret"}
+UPDATE = {"update_id": 1, "message": {
+    "message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "hi",
+}}
+
+
+class FakeApplication:
+    bot = None
+
+    def __init__(self):
+        self.update_queue = asyncio.Queue()
+
+
+@pytest.fixture
+def app():
+    return FakeApplication()
+
+
+@pytest.fixture
+def client(monkeypatch, app):
+    monkeypatch.setattr(settings, "WEBHOOK_SECRET", "secret")
+    return TestClient(web.create_web_app(app))
+
+
+def test_update_is_queued(client, app):
+    assert client.post(settings.WEBHOOK_PATH, json=UPDATE, headers=SECRET).status_code == 200
+    assert app.update_queue.get_nowait().update_id == 1
+
+
+@pytest.mark.parametrize("headers", [{}, {"X-Telegram-Bot-Api-Secret-Token": "wrong"}])
+def test_wrong_secret_is_rejected(client, app, headers):
+    assert client.post(settings.WEBHOOK_PATH, json=UPDATE, headers=headers).status_code == 403
+    assert app.update_queue.empty()
+
+
+def test_empty_secret_rejects_everything(monkeypatch, app):
+    monkeypatch.setattr(settings, "WEBHOOK_SECRET", "")
+    client = TestClient(web.create_web_app(app))
+    headers = {"X-Telegram-Bot-Api-Secret-Token": ""}
+    assert client.post(settings.WEBHOOK_PATH, json=UPDATE, headers=headers).status_code == 403
+
+
+@pytest.mark.parametrize("body", [b"not json", b"[1, 2]", b"{}", b"null"])
+def test_malformed_body_is_400(client, app, body):
+    assert client.post(settings.WEBHOOK_PATH, content=body, headers=SECRET).status_code == 400
+    assert app.update_queue.empty()
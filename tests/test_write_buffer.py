@@ -0,0 +1,163 @@
+import asyncio
+import datetime
+
+import pytest
+from pymongo import DeleteMany, UpdateOne
+
+import db
+
+
+@pytest.fixture
+def written(monkeypatch):
+    """Operations passed to ``bulk_write``, one list per flush."""
+    batches = []
+
+    async def bulk_write(ops):
+        batches.append(ops)
+
+    monkeypatch.setattr(db, "_bulk_write", bulk_write)
+    return batches
+
+
+@pytest.fixture
+def notified(monkeypatch):
+    """Schedule changes announced to ``db.subscribe`` listeners."""
+    events = []
+    monkeypatch.setattr(db, "_schedule_listeners", [lambda chat_id, message_id, due_at: events.append((chat_id, message_id, due_at))])
+    return events
+
+
+def run(*actions):
+    """Apply buffer actions inside a running loop, then flush."""
+    buffer = db.WriteBuffer(max_ops=100, max_delay=60)
+
+    async def main():
+        for action in actions:
+            action(buffer)
+        await buffer.flush()
+        return len(buffer)
+
+    assert asyncio.run(main()) == 0
+
+
+def test_updates_of_one_message_are_merged(written, notified):
+    due_at = datetime.datetime(2026, 10, 18, 14, 35)
+    run(
+        lambda b: b.update(7, 1, {"message": "a"}),
+        lambda b: b.update(7, 1, {"due_at": due_at}),
+        lambda b: b.update(7, 2, {"message": "b"}),
+    )
+    assert written == [[
+        UpdateOne({"chat_id": 7, "message_id": 1}, {"$set": {"message": "a", "due_at": due_at}}),
+        UpdateOne({"chat_id": 7, "message_id": 2}, {"$set": {"message": "b"}}),
+    ]]
+    assert notified == [(7, 1, due_at)]
+
+
+def test_same_message_id_in_other_chats_is_not_merged(written, notified):
+    run(
+        lambda b: b.update(7, 57, {"message_id": 200}),
+        lambda b: b.update(8, 57, {"message_id": 201}),
+    )
+    assert written == [[
+        UpdateOne({"chat_id": 7, "message_id": 57}, {"$set": {"message_id": 200}}),
+        UpdateOne({"chat_id": 8, "message_id": 57}, {"$set": {"message_id": 201}}),
+    ]]
+
+
+def test_update_after_rename_targets_stored_id(written, notified):
+    run(
+        lambda b: b.update(7, 1, {"message_id": 2}),
+        lambda b: b.update(7, 2, {"message_id": 3}),
+        lambda b: b.update(7, 3, {"message": "a"}),
+    )
+    assert written == [[UpdateOne({"chat_id": 7, "message_id": 1}, {"$set": {"message_id": 3, "message": "a"}})]]
+    assert notified == [(7, 1, None), (7, 2, None)]
+
+
+def test_delete_after_rename_drops_pending_update(written, notified):
+    run(
+        lambda b: b.update(7, 1, {"message_id": 2}),
+        lambda b: b.delete({"chat_id": 7, "message_id": 2}),
+    )
+    assert written == [[DeleteMany({"chat_id": 7, "message_id": 1})]]
+    assert notified == [(7, 1, None), (7, 2, None)]
+
+
+def test_delete_in_other_chat_keeps_pending_update(written, notified):
+    run(
+        lambda b: b.update(7, 57, {"message": "a"}),
+        lambda b: b.delete({"chat_id": 8, "message_id": 57}),
+    )
+    assert written == [[
+        UpdateOne({"chat_id": 7, "message_id": 57}, {"$set": {"message": "a"}}),
+        DeleteMany({"chat_id": 8, "message_id": 57}),
+    ]]
+
+
+def test_delete_without_pending_update(written, notified):
+    run(lambda b: b.delete({"message_id": 5, "chat_id": 7}))
+    assert written == [[DeleteMany({"message_id": 5, "chat_id": 7})]]
+    assert notified == [(7, 5, None)]
+
+
+def test_flush_waits_for_flush_in_flight(monkeypatch):
+    events = []
+    release = None
+
+    async def bulk_write(ops):
+        events.append(len(ops))
+        await release.wait()
+
+    monkeypatch.setattr(db, "_bulk_write", bulk_write)
+    monkeypatch.setattr(db, "_schedule_listeners", [])
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        buffer = db.WriteBuffer(max_ops=1, max_delay=60)
+        buffer.update(7, 1, {"message": "a"})  # max_ops достигнут — flush уходит в фон
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(buffer.flush())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        release.set()
+        await waiter
+        assert not buffer._tasks
+
+    asyncio.run(main())
+    assert events == [1]
+
+
+def test_failed_batch_is_retried_before_newer_ones(monkeypatch):
+    batches = []
+    fail = [True]
+
+    async def bulk_write(ops):
+        if fail[0]:
+            fail[0] = False
+            raise asyncio.TimeoutError()
+        batches.append(ops)
+
+    monkeypatch.setattr(db, "_bulk_write", bulk_write)
+    monkeypatch.setattr(db, "_schedule_listeners", [])
+
+    async def main():
+        buffer = db.WriteBuffer(max_ops=100, max_delay=60)
+        buffer.update(7, 1, {"message_id": 2})
+        buffer.delete({"chat_id": 7, "message_id": 5})
+        await buffer.flush()
+        assert len(buffer) == 2
+        assert buffer._timer is not None
+        buffer.update(7, 2, {"message": "a"})
+        await buffer.flush()
+        assert len(buffer) == 0
+
+    asyncio.run(main())
+    assert batches == [
+        [
+            UpdateOne({"chat_id": 7, "message_id": 1}, {"$set": {"message_id": 2}}),
+            DeleteMany({"chat_id": 7, "message_id": 5}),
+        ],
+        [UpdateOne({"chat_id": 7, "message_id": 2}, {"$set": {"message": "a"}})],
+    ]
@@ -0,0 +1,81 @@
+"""ASGI front-end for webhook mode: Telegram updates, health and readiness checks."""
+
+import hmac
+import logging
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from pydantic import BaseModel
+from telegram import Update
+from telegram.ext import Application
+
+import db
+import metrics
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class HealthCheck(BaseModel):
+    status: str = "OK"
+    mongo: bool = False
+
+
+def create_web_app(tg_app: Application, webhook: bool = True) -> FastAPI:
+    """Build the ASGI app that feeds webhook updates into ``tg_app``.
+
+    With ``webhook=False`` only the health checks and metrics are served
+    (long polling mode). ``/health`` is the liveness probe and answers while
+    the process runs; ``/ready`` answers 503 until Mongo is reachable.
+    """
+    web_app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+
+    if webhook:
+
+        @web_app.post(settings.WEBHOOK_PATH)
+        async def telegram_webhook(request: Request) -> Response:
+            # Telegram присылает секрет, заданный в set_webhook, — чужие запросы отбрасываем
+            token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not settings.WEBHOOK_SECRET or not hmac.compare_digest(token, settings.WEBHOOK_SECRET):
+                return Response(status_code=403)
+            try:
+                update = Update.de_json(await request.json(), tg_app.bot)
+            except (ValueError, TypeError, KeyError, AttributeError) as exc:
+                logger.warning("Некорректное тело вебхука: %r", exc)
+                return Response(status_code=400)
+            if update is None:
+                return Response(status_code=400)
+            # Отвечаем Telegram сразу: обработка идёт из очереди приложения
+            await tg_app.update_queue.put(update)
+            return Response(status_code=200)
+
+    @web_app.get("/health", response_model=HealthCheck)
+    async def health() -> HealthCheck:
+        return HealthCheck(mongo=db.mongo.ready)
+
+    @web_app.get("/ready", response_model=HealthCheck)
+    async def ready(response: Response) -> HealthCheck:
+        if not db.mongo.ready:
+            response.status_code = 503
+            return HealthCheck(status="Mongo unavailable")
+        return HealthCheck(mongo=True)
+
+    if settings.METRICS_ENABLED:
+
+        @web_app.get("/metrics")
+        async def metrics_endpoint() -> Response:
+            return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    return web_app
+
+
+class EmbeddedServer(uvicorn.Server):
+    """uvicorn server running next to ``run_polling``, which owns the signal handlers."""
+
+    def install_signal_handlers(self) -> None:
+        pass
+
+
+def create_server(web_app: FastAPI, embedded: bool = False) -> uvicorn.Server:
+    config = uvicorn.Config(web_app, host=settings.LISTEN_HOST, port=int(settings.PORT), log_level="info")
+    return EmbeddedServer(config) if embedded else uvicorn.Server(config)